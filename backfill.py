@@ -0,0 +1,319 @@
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+
+from routing import routing_table
+
+logger = logging.getLogger('routing.backfill')
+
+BACKFILL_MODELS = {
+    'package': 'SubscriptionPackage',
+    'service': 'SubscriptionPackageService',
+    'link': 'SubscriptionPackageLinkService',
+    'attribute': 'SubscriptionPackageServiceAttribute',
+}
+
+# Packages go first and take their links, services and attributes along;
+# the later phases sweep up rows not reachable from a legacy package.
+PHASES = ('package', 'service', 'link', 'attribute')
+
+
+class BackfillError(DatabaseError):
+    """
+    A batch did not move the expected number of rows; it was rolled
+    back.
+    """
+
+
+class Checkpoint:
+    """
+    Last processed id of every id range, one small file per range in
+    `directory`, so parallel workers never write the same file, and the
+    id ranges planned for each phase.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def get(self, name):
+        try:
+            with open(self._path(name)) as f:
+                return int(f.read())
+        except FileNotFoundError:
+            return None
+
+    def set(self, name, last_id):
+        self._write(name, str(last_id))
+
+    def get_plan(self, phase):
+        """
+        Return the `(lo, hi)` ranges planned for `phase`, or None.
+        """
+        try:
+            with open(self._path(f'{phase}.plan')) as f:
+                return [tuple(bounds) for bounds in json.load(f)]
+        except FileNotFoundError:
+            return None
+
+    def set_plan(self, phase, ranges):
+        self._write(f'{phase}.plan', json.dumps(ranges))
+
+    def _write(self, name, data):
+        path = self._path(name)
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(f'{path}.tmp', path)
+
+
+class RateLimiter:
+    """
+    Sleeps between batches to keep the moved rows of one worker under
+    `rows_per_second`. No limit if None.
+    """
+
+    def __init__(self, rows_per_second=None):
+        self.rows_per_second = rows_per_second
+        self._started = time.monotonic()
+        self._rows = 0
+
+    def wait(self, rows):
+        if not self.rows_per_second:
+            return
+        self._rows += rows
+        delay = self._rows / self.rows_per_second - (time.monotonic() - self._started)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Backfill:
+    """
+    Moves the rows of the legacy package tables into their `_new`
+    tables, so the combined views can eventually be retired.
+
+    Every phase splits the id range of its legacy table into one range
+    per worker. Each range is walked in keyset order, `batch_size` ids
+    at a time. A package batch moves the packages together with their
+    links, their services and the attributes of those services in one
+    transaction: the rows are locked, copied with
+    `INSERT ... SELECT` and deleted from the legacy table. The batch is
+    rolled back unless every table inserted and deleted exactly the
+    locked number of rows. Since the combined views return the union of
+    both tables, readers see every row exactly once throughout, and
+    routed updates fall back to the new table once a row has moved.
+
+    The id ranges of a phase are planned once, from the legacy table as
+    it is when the phase first runs, and stored with the checkpoints.
+    The last id of each range is checkpointed after every committed
+    batch, so an interrupted run resumes with the same ranges where it
+    stopped, even though moved rows changed the table's id range. Remove
+    the checkpoint directory to plan a fresh run.
+
+    The legacy and new tables must use disjoint id ranges, as the ids
+    are kept (links refer to them).
+
+    :param batch_size: Number of head rows (e.g. packages) per batch.
+    :param rows_per_second: Rate limit of each worker, in moved rows.
+    :param workers: Number of worker processes.
+    :param checkpoint_dir: Directory of the checkpoint files.
+    """
+
+    def __init__(
+        self,
+        batch_size=100,
+        rows_per_second=None,
+        workers=1,
+        checkpoint_dir='backfill-checkpoints',
+        using=DEFAULT_DB_ALIAS,
+    ):
+        self.batch_size = batch_size
+        self.rows_per_second = rows_per_second
+        self.workers = workers
+        self.checkpoint_dir = checkpoint_dir
+        self.using = using
+
+    def _table(self, kind):
+        opts = apps.get_model('contracts', BACKFILL_MODELS[kind])._meta
+        return routing_table.get(opts.db_table), opts
+
+    def run(self):
+        """
+        Run all phases and return the number of moved rows per table
+        kind.
+        """
+        totals = dict.fromkeys(BACKFILL_MODELS, 0)
+        checkpoint = Checkpoint(self.checkpoint_dir)
+        for phase in PHASES:
+            plan = checkpoint.get_plan(phase)
+            if plan is None:
+                plan = self.ranges(phase)
+                checkpoint.set_plan(phase, plan)
+            ranges = [(phase, lo, hi) for lo, hi in plan]
+            if self.workers > 1 and len(ranges) > 1:
+                # Children must not share the parent's connections
+                connections.close_all()
+                with multiprocessing.get_context('fork').Pool(self.workers) as pool:
+                    results = pool.starmap(self.run_range, ranges)
+            else:
+                results = [self.run_range(*args) for args in ranges]
+            for moved in results:
+                for kind, count in moved.items():
+                    totals[kind] += count
+            logger.info('Backfill phase %s done: %s', phase, totals)
+        return totals
+
+    def ranges(self, phase):
+        """
+        Split the id range of the legacy table of `phase` into one
+        inclusive `(lo, hi)` range per worker.
+        """
+        table, opts = self._table(phase)
+        qn = connections[self.using].ops.quote_name
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(
+                f"SELECT MIN({qn(opts.pk.column)}), MAX({qn(opts.pk.column)}) "
+                f"FROM {qn(table.legacy)}"
+            )
+            lo, hi = cursor.fetchone()
+        if lo is None:
+            return []
+        step = max((hi - lo + 1) // self.workers, 1)
+        bounds = list(range(lo, hi + 1, step)) + [hi + 1]
+        return [(start, end - 1) for start, end in zip(bounds, bounds[1:])]
+
+    def run_range(self, phase, lo, hi):
+        """
+        Move the rows of one id range of a phase, resuming after its
+        checkpoint, and return the number of moved rows per table kind.
+        """
+        checkpoint = Checkpoint(self.checkpoint_dir)
+        limiter = RateLimiter(self.rows_per_second)
+        name = f'{phase}-{lo}-{hi}'
+        last_id = checkpoint.get(name)
+        if last_id is None:
+            last_id = lo - 1
+        table, opts = self._table(phase)
+        qn = connections[self.using].ops.quote_name
+        pk = qn(opts.pk.column)
+        moved = dict.fromkeys(BACKFILL_MODELS, 0)
+        while True:
+            with connections[self.using].cursor() as cursor:
+                cursor.execute(
+                    f"SELECT {pk} FROM {qn(table.legacy)} "
+                    f"WHERE {pk} > %s AND {pk} <= %s ORDER BY {pk} LIMIT %s",
+                    [last_id, hi, self.batch_size],
+                )
+                ids = [row[0] for row in cursor.fetchall()]
+            if not ids:
+                return moved
+            try:
+                counts = self.move_batch(phase, ids)
+            except Exception as e:
+                logging.error(f"Backfill of {phase} ids {ids[0]}-{ids[-1]} failed: {e}")
+                raise
+            last_id = ids[-1]
+            checkpoint.set(name, last_id)
+            for kind, count in counts.items():
+                moved[kind] += count
+            logger.info('Backfill %s moved up to id %s: %s', phase, last_id, counts)
+            limiter.wait(sum(counts.values()))
+
+    def move_batch(self, phase, ids):
+        """
+        Move the given legacy rows of `phase` and the rows depending on
+        them in one transaction, and return the moved rows per kind.
+        """
+        conn = connections[self.using]
+        with transaction.atomic(using=self.using), conn.cursor() as cursor:
+            batch = {phase: self._lock(cursor, phase, 'pk', ids)}
+            if phase == 'package':
+                batch['link'] = self._lock(
+                    cursor, 'link', 'subscriptionpackage', batch['package']
+                )
+                service_ids = self._select(
+                    cursor, 'link', 'subscriptionpackageservice', batch['link']
+                )
+                batch['service'] = self._lock(cursor, 'service', 'pk', service_ids)
+            if phase in ('package', 'service'):
+                batch['attribute'] = self._lock(
+                    cursor,
+                    'attribute',
+                    'subscription_package_service',
+                    batch['service'],
+                )
+            return {
+                kind: self._move(cursor, kind, kind_ids)
+                for kind, kind_ids in batch.items()
+            }
+
+    def _where_in(self, opts, field_name, values):
+        qn = connections[self.using].ops.quote_name
+        field = opts.pk if field_name == 'pk' else opts.get_field(field_name)
+        column = field.column
+        return f"{qn(column)} IN ({', '.join(['%s'] * len(values))})"
+
+    def _lock(self, cursor, kind, field_name, values):
+        """
+        Lock the legacy rows of `kind` whose field matches one of
+        `values`, and return their ids.
+        """
+        if not values:
+            return []
+        table, opts = self._table(kind)
+        conn = connections[self.using]
+        qn = conn.ops.quote_name
+        sql = (
+            f"SELECT {qn(opts.pk.column)} FROM {qn(table.legacy)} "
+            f"WHERE {self._where_in(opts, field_name, values)}"
+        )
+        if conn.features.has_select_for_update:
+            sql += " FOR UPDATE"
+        cursor.execute(sql, list(values))
+        return [row[0] for row in cursor.fetchall()]
+
+    def _select(self, cursor, kind, field_name, ids):
+        """
+        Return the distinct values of a field of the given legacy rows.
+        """
+        if not ids:
+            return []
+        table, opts = self._table(kind)
+        qn = connections[self.using].ops.quote_name
+        cursor.execute(
+            f"SELECT DISTINCT {qn(opts.get_field(field_name).column)} "
+            f"FROM {qn(table.legacy)} WHERE {self._where_in(opts, 'pk', ids)}",
+            list(ids),
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+    def _move(self, cursor, kind, ids):
+        if not ids:
+            return 0
+        table, opts = self._table(kind)
+        qn = connections[self.using].ops.quote_name
+        columns = ", ".join(qn(field.column) for field in opts.concrete_fields)
+        where = self._where_in(opts, 'pk', ids)
+        cursor.execute(
+            f"INSERT INTO {qn(table.new)} ({columns}) "
+            f"SELECT {columns} FROM {qn(table.legacy)} WHERE {where}",
+            list(ids),
+        )
+        inserted = cursor.rowcount
+        cursor.execute(f"DELETE FROM {qn(table.legacy)} WHERE {where}", list(ids))
+        deleted = cursor.rowcount
+        if not inserted == deleted == len(ids):
+            raise BackfillError(
+                f"Moving {len(ids)} rows of {table.legacy} inserted {inserted} "
+                f"and deleted {deleted} rows."
+            )
+        return inserted
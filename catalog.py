@@ -0,0 +1,239 @@
+import threading
+import time
+from typing import Dict, NamedTuple, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+CATALOG_MODELS = {
+    'package': 'products.Package',
+    'service': 'products.Service',
+    'attribute': 'products.ServiceAttribute',
+}
+
+VERSION_KEY = 'product_catalog:version'
+
+
+class CatalogEntry(NamedTuple):
+    id: int
+    code: str
+
+
+class CatalogSnapshot(NamedTuple):
+    """
+    The catalog as loaded at one point in time.
+
+    `version`
+        Number of loads done by this process, including this one.
+
+    `shared_version`
+        The shared version counter at load time, or None without a
+        version cache.
+
+    `loaded_at`
+        The `time.monotonic()` time of the load.
+
+    `by_id`, `by_code`
+        The entries of each kind by id and by code.
+    """
+
+    version: int
+    shared_version: Optional[int]
+    loaded_at: float
+    by_id: Dict[str, Dict[int, CatalogEntry]]
+    by_code: Dict[str, Dict[str, CatalogEntry]]
+
+
+class ProductCatalog:
+    """
+    Process-local, versioned cache of the `Package`, `Service` and
+    `ServiceAttribute` rows, with O(1) lookups by id and by code.
+
+    The whole catalog is loaded with one query per model, on `warm()` or
+    on first use, and replaced as a unit, so readers never take a lock
+    and never see a partial reload. A write to one of the catalog models
+    in this process drops the snapshot through `post_save` and
+    `post_delete`. With a `version_cache` (a Django cache alias) the
+    writes also bump a shared version counter, which other processes
+    compare against their snapshot every `check_interval` seconds.
+
+    A lookup missing an id or code reloads the catalog, at most once per
+    `check_interval`, to pick up rows created by other processes. Within
+    that interval, rows missing from the snapshot are queried directly,
+    one query per lookup or per `ids()` call.
+    """
+
+    def __init__(self, version_cache=None, check_interval=5.0):
+        self.version_cache = version_cache
+        self.check_interval = check_interval
+        self.version = 0
+        self._snapshot = None
+        self._generation = 0
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def _shared_version(self):
+        if self.version_cache is None:
+            return None
+        return caches[self.version_cache].get_or_set(VERSION_KEY, 0, None)
+
+    def load(self):
+        """
+        Load the catalog from the database and return the new snapshot.
+        """
+        generation = self._generation
+        shared_version = self._shared_version()
+        by_id = {}
+        by_code = {}
+        for kind, label in CATALOG_MODELS.items():
+            entries = [
+                CatalogEntry(*row)
+                for row in apps.get_model(label).objects.values_list('id', 'code')
+            ]
+            by_id[kind] = {entry.id: entry for entry in entries}
+            by_code[kind] = {entry.code: entry for entry in entries}
+        with self._lock:
+            self.version += 1
+            snapshot = CatalogSnapshot(
+                self.version, shared_version, time.monotonic(), by_id, by_code
+            )
+            # An invalidation during the load may have been missed
+            if generation == self._generation:
+                self._snapshot = snapshot
+        self._checked_at = snapshot.loaded_at
+        return snapshot
+
+    def warm(self):
+        """
+        Load the catalog ahead of the first lookup.
+
+        Call it once per worker process at startup, after forking, e.g.
+        from gunicorn's `post_fork` or Celery's `worker_process_init`
+        hook; not from `AppConfig.ready()`, which runs before the
+        database may be used. Without it the first lookup loads the
+        catalog.
+        """
+        return self.load()
+
+    def snapshot(self):
+        """
+        Return the current snapshot, reloading it if it was invalidated.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and self.version_cache is not None:
+            now = time.monotonic()
+            if now - self._checked_at >= self.check_interval:
+                self._checked_at = now
+                if self._shared_version() != snapshot.shared_version:
+                    snapshot = None
+        if snapshot is None:
+            snapshot = self.load()
+        return snapshot
+
+    def invalidate(self):
+        """
+        Drop the snapshot of this process and bump the shared version.
+        """
+        with self._lock:
+            self._generation += 1
+            self._snapshot = None
+        if self.version_cache is not None:
+            cache = caches[self.version_cache]
+            try:
+                cache.incr(VERSION_KEY)
+            except ValueError:
+                cache.set(VERSION_KEY, 1, None)
+
+    def _is_stale(self, snapshot):
+        return time.monotonic() - snapshot.loaded_at >= self.check_interval
+
+    def _query(self, kind, **lookup):
+        """
+        Return the entries of the given kind matching `lookup`, read
+        from the database instead of the snapshot.
+        """
+        return [
+            CatalogEntry(*row)
+            for row in apps.get_model(CATALOG_MODELS[kind])
+            .objects.filter(**lookup)
+            .values_list('id', 'code')
+        ]
+
+    def _lookup(self, index, kind, key):
+        snapshot = self.snapshot()
+        entry = getattr(snapshot, index)[kind].get(key)
+        if entry is None:
+            if self._is_stale(snapshot):
+                entry = getattr(self.load(), index)[kind].get(key)
+            else:
+                field = 'id' if index == 'by_id' else 'code'
+                entries = self._query(kind, **{field: key})
+                entry = entries[0] if entries else None
+        return entry
+
+    def get(self, kind, id):
+        """
+        Return the `CatalogEntry` of the given kind and id, or None.
+
+        :param kind: One of `CATALOG_MODELS`.
+        """
+        return self._lookup('by_id', kind, id)
+
+    def get_by_code(self, kind, code):
+        """
+        Return the `CatalogEntry` of the given kind and code, or None.
+        """
+        return self._lookup('by_code', kind, code)
+
+    def code(self, kind, id):
+        """
+        Return the code of the given kind and id, or None.
+        """
+        entry = self.get(kind, id)
+        return None if entry is None else entry.code
+
+    def ids(self, kind, codes):
+        """
+        Return a `{code: id}` dict for the given codes.
+
+        :raises DoesNotExist: If a code is unknown.
+        """
+        codes = list(codes)
+        snapshot = self.snapshot()
+        by_code = snapshot.by_code[kind]
+        missing = [code for code in codes if code not in by_code]
+        if missing and self._is_stale(snapshot):
+            by_code = self.load().by_code[kind]
+            missing = [code for code in codes if code not in by_code]
+        found = {}
+        if missing:
+            # Rows created since the snapshot was loaded
+            found = {entry.code: entry for entry in self._query(kind, code__in=missing)}
+        result = {}
+        for code in codes:
+            entry = by_code.get(code) or found.get(code)
+            if entry is None:
+                raise apps.get_model(CATALOG_MODELS[kind]).DoesNotExist(
+                    f"{CATALOG_MODELS[kind]} matching code {code!r} does not exist."
+                )
+            result[code] = entry.id
+        return result
+
+
+product_catalog = ProductCatalog(
+    version_cache=getattr(settings, 'PRODUCT_CATALOG_VERSION_CACHE', None),
+    check_interval=getattr(settings, 'PRODUCT_CATALOG_CHECK_INTERVAL', 5.0),
+)
+
+
+@receiver(post_save, sender=CATALOG_MODELS['package'])
+@receiver(post_save, sender=CATALOG_MODELS['service'])
+@receiver(post_save, sender=CATALOG_MODELS['attribute'])
+@receiver(post_delete, sender=CATALOG_MODELS['package'])
+@receiver(post_delete, sender=CATALOG_MODELS['service'])
+@receiver(post_delete, sender=CATALOG_MODELS['attribute'])
+def _invalidate_catalog(**kwargs):
+    product_catalog.invalidate()
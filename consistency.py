@@ -0,0 +1,256 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from routing import routing_table
+
+logger = logging.getLogger('routing.consistency')
+
+CHECKED_MODELS = {
+    'package': 'SubscriptionPackage',
+    'service': 'SubscriptionPackageService',
+    'link': 'SubscriptionPackageLinkService',
+    'attribute': 'SubscriptionPackageServiceAttribute',
+}
+
+
+class ChunkDigest(NamedTuple):
+    """
+    Number of rows of an id range and the sum of their row hashes, which
+    does not depend on row order and adds up across tables.
+    """
+
+    count: int
+    digest: int
+
+
+class ConsistencyReport:
+    """
+    Differences found between a view and its legacy and new tables.
+
+    `duplicates`
+        Ids present in both the legacy and the new table, or more than
+        once in the view.
+
+    `missing`
+        Ids in one of the tables but not in the view.
+
+    `extra`
+        Ids in the view but in neither table.
+
+    `divergent`
+        Ids whose view row differs from the table row.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.duplicates = []
+        self.missing = []
+        self.extra = []
+        self.divergent = []
+        self.chunks = 0
+        self.mismatched_chunks = 0
+
+    @property
+    def ok(self):
+        return not (self.duplicates or self.missing or self.extra or self.divergent)
+
+    def update(self, other):
+        self.duplicates.extend(other.duplicates)
+        self.missing.extend(other.missing)
+        self.extra.extend(other.extra)
+        self.divergent.extend(other.divergent)
+        self.chunks += other.chunks
+        self.mismatched_chunks += other.mismatched_chunks
+
+    def __str__(self):
+        return (
+            f'{self.kind}: {self.chunks} chunks, {self.mismatched_chunks} mismatched, '
+            f'{len(self.duplicates)} duplicate, {len(self.missing)} missing, '
+            f'{len(self.extra)} extra, {len(self.divergent)} divergent'
+        )
+
+
+class ConsistencyChecker:
+    """
+    Proves that each combined view returns exactly the union of its
+    legacy and new tables.
+
+    The id space is split into chunks of `chunk_size` ids, checked in
+    parallel by `workers` threads, each with its own connection. For a
+    chunk the row count and the sum of the row hashes of the view are
+    compared with those of the two tables; on PostgreSQL the hashes are
+    computed and summed in SQL, so only two numbers per table cross the
+    wire. Mismatching ranges are bisected, like a Merkle tree, down to
+    `leaf_size` ids, and only those leaves are fetched and compared row
+    by row. Ids present in both tables are looked up per chunk with an
+    index join, since a `UNION ALL` view would hide them from the
+    digests.
+
+    Each chunk is checked in one transaction; on PostgreSQL it runs at
+    REPEATABLE READ, so the view and both tables are read from the same
+    snapshot and concurrent writes cannot show up as differences.
+    """
+
+    def __init__(
+        self, chunk_size=100000, leaf_size=1000, workers=4, using=DEFAULT_DB_ALIAS
+    ):
+        self.chunk_size = chunk_size
+        self.leaf_size = leaf_size
+        self.workers = workers
+        self.using = using
+
+    def _table(self, kind):
+        opts = apps.get_model('contracts', CHECKED_MODELS[kind])._meta
+        return routing_table.get(opts.db_table), opts
+
+    def check_all(self):
+        """
+        Check every routed table and return the reports by kind.
+        """
+        return {kind: self.check(kind) for kind in CHECKED_MODELS}
+
+    def check(self, kind):
+        """
+        Check one routed table and return its `ConsistencyReport`.
+        """
+        report = ConsistencyReport(kind)
+        with ThreadPoolExecutor(self.workers) as executor:
+            for chunk_report in executor.map(
+                lambda bounds: self._check_chunk(kind, *bounds), self.chunks(kind)
+            ):
+                report.update(chunk_report)
+        logger.info('Consistency check %s', report)
+        return report
+
+    def chunks(self, kind):
+        """
+        Return the inclusive id ranges covering both tables of `kind`.
+        """
+        table, opts = self._table(kind)
+        qn = connections[self.using].ops.quote_name
+        pk = qn(opts.pk.column)
+        bounds = []
+        with connections[self.using].cursor() as cursor:
+            for db_table in (table.legacy, table.new):
+                cursor.execute(f"SELECT MIN({pk}), MAX({pk}) FROM {qn(db_table)}")
+                bounds.extend(value for value in cursor.fetchone() if value is not None)
+        if not bounds:
+            return []
+        lo, hi = min(bounds), max(bounds)
+        return [
+            (start, min(start + self.chunk_size - 1, hi))
+            for start in range(lo, hi + 1, self.chunk_size)
+        ]
+
+    def _check_chunk(self, kind, lo, hi):
+        report = ConsistencyReport(kind)
+        report.chunks = 1
+        try:
+            table, opts = self._table(kind)
+            conn = connections[self.using]
+            with transaction.atomic(using=self.using), conn.cursor() as cursor:
+                if conn.vendor == 'postgresql':
+                    cursor.execute(
+                        "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY"
+                    )
+                report.duplicates.extend(self._overlap(cursor, table, opts, lo, hi))
+                self._bisect(cursor, table, opts, lo, hi, report)
+            report.duplicates = sorted(set(report.duplicates))
+        except Exception as e:
+            logging.error(f"Consistency check of {kind} ids {lo}-{hi} failed: {e}")
+            raise
+        finally:
+            # Worker threads own their connection
+            connections[self.using].close()
+        return report
+
+    def _columns(self, opts):
+        qn = connections[self.using].ops.quote_name
+        return ", ".join(qn(field.column) for field in opts.concrete_fields)
+
+    def _digest(self, cursor, db_table, opts, lo, hi):
+        conn = connections[self.using]
+        qn = conn.ops.quote_name
+        pk = qn(opts.pk.column)
+        columns = self._columns(opts)
+        where = f"WHERE {pk} BETWEEN %s AND %s"
+        if conn.vendor == 'postgresql':
+            # The first 60 bits of the MD5 of the row's text form
+            row_hash = (
+                f"('x' || substr(md5(ROW({columns})::text), 1, 15))::bit(60)::bigint"
+            )
+            cursor.execute(
+                f"SELECT COUNT(*), COALESCE(SUM({row_hash}), 0) "
+                f"FROM {qn(db_table)} {where}",
+                [lo, hi],
+            )
+            count, digest = cursor.fetchone()
+            return ChunkDigest(count, int(digest))
+        cursor.execute(f"SELECT {columns} FROM {qn(db_table)} {where}", [lo, hi])
+        count = digest = 0
+        for row in cursor.fetchall():
+            count += 1
+            digest += _row_hash(row)
+        return ChunkDigest(count, digest)
+
+    def _bisect(self, cursor, table, opts, lo, hi, report):
+        view = self._digest(cursor, table.view, opts, lo, hi)
+        legacy = self._digest(cursor, table.legacy, opts, lo, hi)
+        new = self._digest(cursor, table.new, opts, lo, hi)
+        if view == ChunkDigest(legacy.count + new.count, legacy.digest + new.digest):
+            return
+        report.mismatched_chunks += 1
+        if hi - lo < self.leaf_size:
+            self._diff_leaf(cursor, table, opts, lo, hi, report)
+            return
+        mid = (lo + hi) // 2
+        self._bisect(cursor, table, opts, lo, mid, report)
+        self._bisect(cursor, table, opts, mid + 1, hi, report)
+
+    def _rows(self, cursor, db_table, opts, lo, hi):
+        qn = connections[self.using].ops.quote_name
+        pk = qn(opts.pk.column)
+        cursor.execute(
+            f"SELECT {self._columns(opts)} FROM {qn(db_table)} "
+            f"WHERE {pk} BETWEEN %s AND %s",
+            [lo, hi],
+        )
+        pk_index = opts.concrete_fields.index(opts.pk)
+        rows = {}
+        for row in cursor.fetchall():
+            rows.setdefault(row[pk_index], []).append(row)
+        return rows
+
+    def _diff_leaf(self, cursor, table, opts, lo, hi, report):
+        view_rows = self._rows(cursor, table.view, opts, lo, hi)
+        table_rows = self._rows(cursor, table.legacy, opts, lo, hi)
+        for pk, rows in self._rows(cursor, table.new, opts, lo, hi).items():
+            table_rows.setdefault(pk, []).extend(rows)
+        for pk, rows in view_rows.items():
+            if len(rows) > 1:
+                report.duplicates.append(pk)
+            if pk not in table_rows:
+                report.extra.append(pk)
+            elif sorted(map(_row_hash, rows)) != sorted(map(_row_hash, table_rows[pk])):
+                report.divergent.append(pk)
+        report.missing.extend(pk for pk in table_rows if pk not in view_rows)
+
+    def _overlap(self, cursor, table, opts, lo, hi):
+        qn = connections[self.using].ops.quote_name
+        pk = qn(opts.pk.column)
+        cursor.execute(
+            f"SELECT l.{pk} FROM {qn(table.legacy)} l "
+            f"JOIN {qn(table.new)} n ON n.{pk} = l.{pk} "
+            f"WHERE l.{pk} BETWEEN %s AND %s",
+            [lo, hi],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _row_hash(row):
+    return int(hashlib.md5(repr(tuple(row)).encode()).hexdigest()[:15], 16)
@@ -0,0 +1,204 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import FrozenSet, NamedTuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import router, transaction
+from django.utils.module_loading import import_string
+
+
+class Entitlements(NamedTuple):
+    """
+    The codes of the packages and services active for a subscription.
+    """
+
+    package_codes: FrozenSet[str]
+    service_codes: FrozenSet[str]
+
+
+class LocMemBackend:
+    """
+    In-process LRU backend holding at most `maxsize` subscriptions for at
+    most `timeout` seconds each.
+
+    Invalidations only reach the process they happen in, so other worker
+    processes serve their entries until they expire. Use it for single
+    process deployments and tests only.
+    """
+
+    def __init__(self, maxsize=10000, timeout=60):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, subscription_id):
+        with self._lock:
+            entry = self._entries.get(subscription_id)
+            if entry is None:
+                return None
+            expires_at, entitlements = entry
+            if expires_at <= time.monotonic():
+                del self._entries[subscription_id]
+                return None
+            self._entries.move_to_end(subscription_id)
+            return entitlements
+
+    def set(self, subscription_id, entitlements):
+        with self._lock:
+            self._entries[subscription_id] = (
+                time.monotonic() + self.timeout,
+                entitlements,
+            )
+            self._entries.move_to_end(subscription_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, subscription_id):
+        with self._lock:
+            self._entries.pop(subscription_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """
+    Backend storing the entitlements in a Django cache, shared between
+    processes, so an invalidation reaches every worker. This is the
+    default backend. Evictions are done by the cache itself and not
+    counted.
+    """
+
+    evictions = 0
+
+    def __init__(self, alias='default', timeout=300, key_prefix='entitlements'):
+        self.cache = caches[alias]
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+
+    def _key(self, subscription_id):
+        return f'{self.key_prefix}:{subscription_id}'
+
+    def get(self, subscription_id):
+        value = self.cache.get(self._key(subscription_id))
+        if value is None:
+            return None
+        return Entitlements(frozenset(value[0]), frozenset(value[1]))
+
+    def set(self, subscription_id, entitlements):
+        self.cache.set(
+            self._key(subscription_id),
+            (list(entitlements.package_codes), list(entitlements.service_codes)),
+            self.timeout,
+        )
+
+    def delete(self, subscription_id):
+        self.cache.delete(self._key(subscription_id))
+
+    def clear(self):
+        self.cache.clear()
+
+
+def load_entitlements(subscription_id):
+    """
+    Query the active package and service codes of a subscription.
+
+    The codes are read from the primary database: a lagging replica
+    could return the state from before the write that invalidated the
+    entry, which would then be cached.
+    """
+    package_model = apps.get_model('contracts', 'SubscriptionPackage')
+    service_model = apps.get_model('contracts', 'SubscriptionPackageService')
+    packages = package_model.objects.db_manager(router.db_for_write(package_model))
+    services = service_model.objects.db_manager(router.db_for_write(service_model))
+    return Entitlements(
+        frozenset(
+            packages.active(subscription_id=subscription_id).values_list(
+                'package__code', flat=True
+            )
+        ),
+        frozenset(
+            services.active(subscription_id=subscription_id).values_list(
+                'service__code', flat=True
+            )
+        ),
+    )
+
+
+class EntitlementCache:
+    """
+    Read-through cache of the active entitlements of each subscription.
+
+    Entries are dropped by `invalidate` whenever a package or service of
+    the subscription is written; `stats` reports hits, misses and
+    evictions.
+    """
+
+    def __init__(self, backend, loader=load_entitlements):
+        self.backend = backend
+        self.loader = loader
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, subscription_id):
+        """
+        Return the `Entitlements` of the subscription, loading them on a
+        cache miss.
+        """
+        entitlements = self.backend.get(subscription_id)
+        if entitlements is not None:
+            self.hits += 1
+            return entitlements
+        self.misses += 1
+        entitlements = self.loader(subscription_id)
+        self.backend.set(subscription_id, entitlements)
+        return entitlements
+
+    def invalidate(self, subscription_id, using=None):
+        """
+        Drop the cached entitlements of the subscription once the write
+        preceding this call is visible to other connections: right away
+        outside a transaction, otherwise when the transaction of `using`
+        commits. Call it after the write, or a concurrent reader could
+        cache the state from before it.
+        """
+        if transaction.get_connection(using).in_atomic_block:
+            # Readers inside the transaction see its writes already
+            self.backend.delete(subscription_id)
+        transaction.on_commit(lambda: self.backend.delete(subscription_id), using=using)
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.backend.evictions,
+        }
+
+
+def _backend_from_settings():
+    backend = getattr(settings, 'ENTITLEMENT_CACHE_BACKEND', DjangoCacheBackend)
+    if isinstance(backend, str):
+        backend = import_string(backend)
+    return backend(**getattr(settings, 'ENTITLEMENT_CACHE_OPTIONS', {}))
+
+
+entitlement_cache = EntitlementCache(_backend_from_settings())
+
+
+def invalidate_entitlements(subscription_id, using=None):
+    """
+    Drop the cached entitlements of the subscription after a write to
+    the database `using`.
+    """
+    if subscription_id is not None:
+        entitlement_cache.invalidate(subscription_id, using=using)
@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_lifecycle_context = ContextVar('lifecycle_context', default=None)
+
+
+class LifecycleContext:
+    """
+    State shared by the steps of one lifecycle operation (e.g. the
+    deactivation of a package and its services, or a bulk run).
+
+    `Subscription.calculate_keep_till` results are memoized per
+    `(subscription, package, deactivated_at)`, including falsy results
+    such as 0, and each subscription is loaded at most once.
+    """
+
+    def __init__(self):
+        self.subscriptions = {}
+        self.keep_tills = {}
+
+    @staticmethod
+    def key(subscription_id, package, deactivated_at):
+        return subscription_id, getattr(package, 'pk', package), deactivated_at
+
+    def add_subscriptions(self, subscriptions):
+        """
+        Make already loaded subscriptions available to the operation.
+        """
+        for subscription in subscriptions:
+            self.subscriptions[subscription.pk] = subscription
+
+    def subscription_for(self, instance):
+        """
+        Return the subscription of `instance`, loading it only if the
+        operation has not seen it yet.
+        """
+        subscription = self.subscriptions.get(instance.subscription_id)
+        if subscription is None:
+            subscription = instance.subscription
+            self.subscriptions[instance.subscription_id] = subscription
+        elif not type(instance).subscription.is_cached(instance):
+            instance.subscription = subscription
+        return subscription
+
+    def keep_till(self, subscription, package, deactivated_at):
+        """
+        Return the memoized `keep_till` of the subscription.
+        """
+        key = self.key(subscription.pk, package, deactivated_at)
+        if key not in self.keep_tills:
+            self.keep_tills[key] = subscription.calculate_keep_till(
+                package, deactivated_at
+            )
+        return self.keep_tills[key]
+
+    def keep_till_for(self, instance, package, deactivated_at):
+        """
+        Return the memoized `keep_till` of the subscription of
+        `instance`, without loading the subscription on a hit.
+        """
+        key = self.key(instance.subscription_id, package, deactivated_at)
+        if key in self.keep_tills:
+            return self.keep_tills[key]
+        return self.keep_till(self.subscription_for(instance), package, deactivated_at)
+
+
+@contextmanager
+def lifecycle_operation(subscriptions=()):
+    """
+    Run the block as one lifecycle operation. Nested blocks join the
+    operation of the outermost one::
+
+        with lifecycle_operation([subscription]):
+            for package in packages:
+                package.deactivate(package=package.package)
+
+    :param subscriptions: Already loaded subscriptions to reuse.
+    """
+    context = _lifecycle_context.get()
+    token = None
+    if context is None:
+        context = LifecycleContext()
+        token = _lifecycle_context.set(context)
+    context.add_subscriptions(subscriptions)
+    try:
+        yield context
+    finally:
+        if token is not None:
+            _lifecycle_context.reset(token)
+
+
+def calculate_keep_till(instance, package, deactivated_at):
+    """
+    Return the `keep_till` of a package or service deactivated at
+    `deactivated_at`, memoized within the current lifecycle operation.
+    """
+    context = _lifecycle_context.get()
+    if context is None:
+        return instance.subscription.calculate_keep_till(package, deactivated_at)
+    return context.keep_till_for(instance, package, deactivated_at)
@@ -1,117 +1,1754 @@
-from django.db import models, connection, router
-from django.db.models import QuerySet, Q, F, Lookup
+import heapq
+import threading
+from collections import Counter, OrderedDict
+from itertools import islice
+from operator import attrgetter
+from typing import NamedTuple
+
+from django.db import (
+    DatabaseError,
+    NotSupportedError,
+    models,
+    connection,
+    connections,
+    router,
+    transaction,
+)
+from django.db.models import (
+    DEFERRED,
+    QuerySet,
+    Q,
+    F,
+    Func,
+    Lookup,
+    prefetch_related_objects,
+)
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.deletion import Collector
+from django.db.models.expressions import Col
+from django.db.models.lookups import GreaterThan
+from django.db.models.sql import Query
+from django.db.models.sql.constants import CURSOR, GET_ITERATOR_CHUNK_SIZE
+from django.db.models.sql.subqueries import DeleteQuery, InsertQuery, UpdateQuery
+from django.db.models.sql.where import WhereNode
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.db.models.signals import class_prepared, post_delete, pre_delete
+from django.dispatch import receiver
 
+from catalog import product_catalog
+from entitlements import invalidate_entitlements
+from lifecycle import calculate_keep_till, lifecycle_operation
+from routing import current_routing_mode, pin_to_primary, routing_table
+from tracing import tracer
 
-class SubscriptionPackageQuerySet(models.QuerySet):
-    def _rewrite_table_name(self):
-        """Rewrite the table names dynamically in the query alias map."""
-        if not hasattr(self.query, "alias_map"):
-            return  # Skip if alias_map is not available (e.g., raw queries)
-
-        for alias, table in self.query.alias_map.items():
-            if table.table_name == 'contracts_subscriptionpackage_services':
-                table.table_name = 'view_contracts_subscriptionpackage_services'
-            if table.table_name == 'contracts_subscriptionpackageservice':
-                table.table_name = 'view_contracts_subscriptionpackageservice'
-        # Rewrite explicit table names in WHERE conditions (if required)
-        if hasattr(self.query, "where"):
-            self._rewrite_where(self.query.where)
-
-    def _rewrite_where(self, where_clause):
-        """Recursively rewrite table names in the WHERE clause."""
-        if hasattr(where_clause, "children"):
-            for child in where_clause.children:
-                if hasattr(child, "lhs") and hasattr(child.lhs, "target"):
-                    # Check if the child is a reference to a table/column
-                    table_name = child.lhs.target.model._meta.db_table
-                    if table_name == 'contracts_subscriptionpackage_services':
-                        child.lhs.target.model._meta.db_table = (
-                            'view_contracts_subscriptionpackage_services'
-                        )
-                    elif table_name == 'contracts_subscriptionpackageservice':
-                        child.lhs.target.model._meta.db_table = (
-                            'view_contracts_subscriptionpackageservice'
+
+class _RoutedOptions:
+    """
+    Read-only view of a model's `Options` with a different `db_table`.
+    """
+
+    def __init__(self, opts, db_table):
+        self._opts = opts
+        self.db_table = db_table
+
+    def __getattr__(self, name):
+        return getattr(self._opts, name)
+
+
+class _RoutedModel:
+    """
+    Stand-in for a model class whose `_meta` is a `_RoutedOptions`.
+    """
+
+    def __init__(self, opts):
+        self._meta = opts
+
+
+class _RoutedField:
+    """
+    A field as seen from a `_RoutedModel`, so that backends qualifying
+    columns with `field.model._meta.db_table` use the physical table.
+    """
+
+    def __init__(self, field, model):
+        self._field = field
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self._field, name)
+
+
+class RoutedInsertCompilerMixin:
+    """
+    Qualifies the RETURNING columns of an insert with the table the
+    rows are inserted into rather than `Model._meta.db_table`.
+    """
+
+    def as_sql(self):
+        returning_fields = self.returning_fields
+        if returning_fields:
+            model = _RoutedModel(self.query.get_meta())
+            self.returning_fields = [
+                _RoutedField(field, model) for field in returning_fields
+            ]
+        try:
+            return super().as_sql()
+        finally:
+            self.returning_fields = returning_fields
+
+
+class RoutedInsertQuery(InsertQuery):
+    """
+    An insert query targeting the routed write table of its model
+    instead of `Model._meta.db_table`.
+    """
+
+    def __init__(self, model, *args, **kwargs):
+        super().__init__(model, *args, **kwargs)
+        self.db_table = routing_table.write_table(model)
+
+    def get_meta(self):
+        return _RoutedOptions(self.model._meta, self.db_table)
+
+    def get_compiler(self, using=None, connection=None, elide_empty=True):
+        if using is None and connection is None:
+            raise ValueError("Need either using or connection")
+        if using:
+            connection = connections[using]
+        compiler_class = _compiler_class(
+            RoutedInsertCompilerMixin, connection.ops.compiler(self.compiler)
+        )
+        return compiler_class(self, connection, using, elide_empty)
+
+
+class _PhysicalTableQueryMixin:
+    """
+    Compiles the model's table as the physical table `db_table` by
+    seeding the compiler's quote cache, like `RoutedQuery` does for
+    reads.
+    """
+
+    db_table = None
+
+    def get_compiler(self, using=None, connection=None, elide_empty=True):
+        compiler = super().get_compiler(using, connection, elide_empty)
+        if self.db_table is not None:
+            compiler.quote_cache[self.get_meta().db_table] = (
+                compiler.connection.ops.quote_name(self.db_table)
+            )
+        return compiler
+
+
+class RoutedUpdateQuery(_PhysicalTableQueryMixin, UpdateQuery):
+    """
+    An update query writing rows by id in both the legacy and the new
+    table of its model.
+    """
+
+    def update_batch(self, pk_list, values, using):
+        """
+        Update the rows in `pk_list` and return the number of rows
+        updated.
+        """
+        self.add_update_values(values)
+        rows = 0
+        for self.db_table in routing_table.get(self.get_meta().db_table)[:2]:
+            for offset in range(0, len(pk_list), GET_ITERATOR_CHUNK_SIZE):
+                self.clear_where()
+                self.add_filter(
+                    'pk__in', pk_list[offset : offset + GET_ITERATOR_CHUNK_SIZE]
+                )
+                rows += self.get_compiler(using).execute_sql(CURSOR)
+        return rows
+
+
+class RoutedDeleteQuery(_PhysicalTableQueryMixin, DeleteQuery):
+    """
+    A delete query removing rows by id from both the legacy and the new
+    table of its model.
+    """
+
+    def do_query(self, table, where, using):
+        rows = 0
+        for self.db_table in routing_table.get(table)[:2]:
+            rows += super().do_query(table, where, using)
+        return rows
+
+
+def _routes_writes(model):
+    # The `_new` models share the routed querysets but own a single table
+    return settings.DB_ROUTING == 1 and issubclass(model, RoutedModelMixin)
+
+
+class RoutedCollector(Collector):
+    """
+    A deletion collector removing the rows of the routed models from both
+    their legacy and new table.
+
+    Related rows are collected through the routed base managers, i.e.
+    read through the views; only the UPDATE and DELETE statements differ
+    from Django's `Collector`.
+    """
+
+    def delete(self):
+        for model, instances in self.data.items():
+            self.data[model] = sorted(instances, key=attrgetter('pk'))
+        self.sort()
+        deleted_counter = Counter()
+
+        with transaction.atomic(using=self.using, savepoint=False):
+            for model, obj in self.instances_with_model():
+                if not model._meta.auto_created:
+                    pre_delete.send(
+                        sender=model, instance=obj, using=self.using, origin=self.origin
+                    )
+
+            for qs in self.fast_deletes:
+                count = qs._raw_delete(using=self.using)
+                if count:
+                    deleted_counter[qs.model._meta.label] += count
+
+            for (field, value), instances_list in self.field_updates.items():
+                for instances in instances_list:
+                    if not isinstance(instances, QuerySet):
+                        objs = list(instances)
+                        if not objs:
+                            continue
+                        instances = objs[0].__class__._base_manager.using(
+                            self.using
+                        ).filter(pk__in=[obj.pk for obj in objs])
+                    instances.update(**{field.name: value})
+
+            for instances in self.data.values():
+                instances.reverse()
+
+            for model, instances in self.data.items():
+                if _routes_writes(model):
+                    query = RoutedDeleteQuery(model)
+                else:
+                    query = DeleteQuery(model)
+                count = query.delete_batch(
+                    [obj.pk for obj in instances], self.using
+                )
+                if count:
+                    deleted_counter[model._meta.label] += count
+
+                if not model._meta.auto_created:
+                    for obj in instances:
+                        post_delete.send(
+                            sender=model,
+                            instance=obj,
+                            using=self.using,
+                            origin=self.origin,
                         )
 
-                # Handle nested conditions
-                if hasattr(child, "children"):
-                    self._rewrite_where(child)
+        for model, instances in self.data.items():
+            for instance in instances:
+                setattr(instance, model._meta.pk.attname, None)
+        return sum(deleted_counter.values()), dict(deleted_counter)
+
+
+class SQLTemplate(NamedTuple):
+    """
+    A compiled SELECT statement together with the compiler state needed
+    to turn its rows into results.
+    """
+
+    sql: str
+    select: list
+    klass_info: dict
+    annotation_col_map: dict
+    col_count: int
+
+
+class SQLTemplateCache:
+    """
+    Bounded LRU cache of compiled `SQLTemplate` objects keyed by query
+    shape, with hit and miss counters.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._templates = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            template = self._templates.get(key)
+            if template is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._templates.move_to_end(key)
+            return template
+
+    def set(self, key, template):
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._templates),
+            'maxsize': self.maxsize,
+        }
+
+
+sql_template_cache = SQLTemplateCache(
+    getattr(settings, 'DB_ROUTING_SQL_CACHE_SIZE', 256)
+)
+
+
+@receiver(setting_changed)
+def _clear_sql_template_cache(setting, **kwargs):
+    if setting in ('DB_ROUTING', 'DB_ROUTED_TABLES'):
+        sql_template_cache.clear()
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+# Lookups whose SQL only depends on the shape of their right-hand side.
+_TEMPLATE_LOOKUPS = frozenset(
+    (
+        'exact',
+        'iexact',
+        'gt',
+        'gte',
+        'lt',
+        'lte',
+        'in',
+        'isnull',
+        'range',
+        'startswith',
+        'istartswith',
+        'contains',
+        'icontains',
+    )
+)
+
+
+def _where_shape(node):
+    if isinstance(node, WhereNode):
+        return (
+            node.connector,
+            node.negated,
+            tuple(_where_shape(child) for child in node.children),
+        )
+    if (
+        not isinstance(node, Lookup)
+        or node.lookup_name not in _TEMPLATE_LOOKUPS
+        or not isinstance(node.lhs, Col)
+        or hasattr(node.rhs, 'resolve_expression')
+    ):
+        raise _Uncacheable
+    rhs = node.rhs
+    if node.lookup_name == 'in':
+        # Same de-duplication as the `In` lookup, which emits one
+        # placeholder per distinct non-NULL value.
+        try:
+            rhs_shape = len(set(rhs) - {None})
+        except TypeError:
+            rhs_shape = len([value for value in rhs if value is not None])
+        if not rhs_shape:
+            raise _Uncacheable
+    elif isinstance(rhs, bool):
+        rhs_shape = rhs
+    else:
+        rhs_shape = None
+    return (node.__class__, node.lhs.alias, node.lhs.target.column, rhs_shape)
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    return value
+
+
+def query_shape(query):
+    """
+    Return a hashable structural fingerprint of a SELECT query that
+    leaves out its parameter values, or None if the query uses features
+    whose SQL cannot be reused with different parameters.
+    """
+    if (
+        query.annotations
+        or query.extra
+        or query.extra_tables
+        or query.extra_order_by
+        or query.combinator
+        or query.subquery
+        or query.distinct_fields
+        or query.select_for_update
+        or query.group_by is not None
+        or not all(isinstance(field, str) for field in query.order_by)
+    ):
+        return None
+    try:
+        where = _where_shape(query.where)
+    except _Uncacheable:
+        return None
+    tables = []
+    for alias, table in query.alias_map.items():
+        if getattr(table, 'filtered_relation', None) is not None:
+            return None
+        tables.append(
+            (
+                alias,
+                table.table_name,
+                getattr(table, 'join_type', None),
+                getattr(table, 'parent_alias', None),
+                getattr(table, 'join_field', None),
+                query.alias_refcount[alias],
+            )
+        )
+    return (
+        query.model,
+        tuple(tables),
+        where,
+        tuple((col.alias, col.target.column) for col in query.select),
+        query.values_select,
+        query.default_cols,
+        _freeze(query.select_related),
+        (frozenset(query.deferred_loading[0]), query.deferred_loading[1]),
+        query.order_by,
+        query.default_ordering,
+        query.standard_ordering,
+        query.distinct,
+        query.low_mark,
+        query.high_mark,
+    )
+
+
+class SQLTemplateCompilerMixin:
+    """
+    Reuses the SQL compiled for an earlier query of the same shape.
+
+    On a cache hit only the WHERE clause is compiled to bind the
+    parameters; SELECT, FROM, JOIN and ORDER BY construction, and the
+    routed table substitution, are skipped.
+    """
+
+    def as_sql(self, with_limits=True, with_col_aliases=False):
+        shape = query_shape(self.query) if sql_template_cache.maxsize else None
+        if shape is None:
+            return super().as_sql(with_limits, with_col_aliases)
+        # A per-query mode only applies to the model's own table, so both
+        # modes shape the SQL
+        key = (
+            self.connection.alias,
+            self.query.read_mode,
+            current_routing_mode()[0],
+            with_limits,
+            with_col_aliases,
+            self.elide_empty,
+            shape,
+        )
+        template = sql_template_cache.get(key)
+        if template is None:
+            sql, params = super().as_sql(with_limits, with_col_aliases)
+            sql_template_cache.set(
+                key,
+                SQLTemplate(
+                    sql,
+                    self.select,
+                    self.klass_info,
+                    self.annotation_col_map,
+                    self.col_count,
+                ),
+            )
+            return sql, params
+        self.select = template.select
+        self.klass_info = template.klass_info
+        self.annotation_col_map = template.annotation_col_map
+        self.col_count = template.col_count
+        self.has_extra_select = False
+        self.where, self.having, self.qualify = self.query.where, None, None
+        params = []
+        if self.query.where.children:
+            params = self.compile(self.query.where)[1]
+        return template.sql, tuple(params)
+
+
+_compiler_classes = {}
+
+
+def _compiler_class(mixin, compiler_class):
+    """
+    Return the backend's `compiler_class` extended with `mixin`, created
+    once per pair.
+    """
+    try:
+        return _compiler_classes[mixin, compiler_class]
+    except KeyError:
+        return _compiler_classes.setdefault(
+            (mixin, compiler_class),
+            type(compiler_class.__name__, (mixin, compiler_class), {}),
+        )
+
+
+def _template_compiler_class(compiler_class):
+    return _compiler_class(SQLTemplateCompilerMixin, compiler_class)
+
+
+class RoutedQuery(Query):
+    """
+    A query reading the routed tables of the current routing scope.
+
+    The compiler quotes every table name of the FROM and JOIN clauses,
+    and every column's table alias, through `quote_name_unless_alias`.
+    Seeding its quote cache with the routed names substitutes the
+    tables once per compiled query, without walking the alias map or
+    the WHERE tree and without string replacement on the final SQL.
+    Compiled statements are shared between queries of the same shape
+    through `sql_template_cache`.
+
+    `read_mode`, if set, overrides the routing mode of the model's own
+    table only; joined routed tables keep the mode of the scope.
+    """
+
+    read_mode = None
+
+    def get_compiler(self, using=None, connection=None, elide_empty=True):
+        if using is None and connection is None:
+            raise ValueError("Need either using or connection")
+        if using:
+            connection = connections[using]
+        compiler_class = _template_compiler_class(
+            connection.ops.compiler(self.compiler)
+        )
+        quote_name = connection.ops.quote_name
+        read_map = routing_table.current_read_map()
+        if self.read_mode is not None:
+            own_table = routing_table.get(self.model._meta.db_table)
+            mode_map = routing_table.maps[self.read_mode]
+            read_map = {**read_map, **{name: mode_map[name] for name in own_table}}
+        quoted = {
+            name: quote_name(table_name)
+            for name, table_name in read_map.items()
+            if name != table_name
+        }
+        query = self
+        if self.extra:
+            # Raw extra selects, such as the related ids Django selects when
+            # prefetching a many-to-many relation, name the declared tables.
+            query = self.clone()
+            query.extra = {
+                alias: (_route_raw_sql(sql, quoted, quote_name), params)
+                for alias, (sql, params) in self.extra.items()
+            }
+        compiler = compiler_class(query, connection, using, elide_empty)
+        compiler.quote_cache.update(quoted)
+        return compiler
+
+
+def _route_raw_sql(sql, quoted, quote_name):
+    """
+    Replace the quoted routed table names qualifying columns in the raw
+    SQL fragment `sql` with the tables in `quoted`.
+    """
+    for name, table_name in quoted.items():
+        sql = sql.replace(f'{quote_name(name)}.', f'{table_name}.')
+    return sql
+
+
+class LookupTranslator:
+    """
+    Translates filter lookups of a routed model.
+
+    Lookup path segments naming a routed table are replaced with the
+    table's view, segment by segment so that a table name is never
+    matched inside a longer one. Translations are memoized per lookup
+    string, so each distinct lookup is translated once per model.
+    """
+
+    def __init__(self, model, tables=routing_table.read_map):
+        self.model = model
+        self.tables = tables
+        self._paths = {}
+
+    def translate_path(self, path):
+        try:
+            return self._paths[path]
+        except KeyError:
+            tables = self.tables
+            translated = LOOKUP_SEP.join(
+                tables.get(part, part) for part in path.split(LOOKUP_SEP)
+            )
+            return self._paths.setdefault(path, translated)
+
+    def translate_kwargs(self, kwargs):
+        return {self.translate_path(key): value for key, value in kwargs.items()}
+
+    def translate_q(self, q):
+        translated = Q()
+        translated.connector = q.connector
+        translated.negated = q.negated
+        translated.children = [self.translate_child(child) for child in q.children]
+        return translated
+
+    def translate_child(self, child):
+        if isinstance(child, Q):
+            return self.translate_q(child)
+        if isinstance(child, tuple):
+            return self.translate_path(child[0]), child[1]
+        # Expressions such as `Exists()` or lookups carry no lookup path
+        return child
+
+    def translate_args(self, args):
+        return [self.translate_q(arg) if isinstance(arg, Q) else arg for arg in args]
+
+
+_lookup_translators = {}
+
+
+def lookup_translator(model):
+    """
+    Return the shared `LookupTranslator` of the model.
+    """
+    try:
+        return _lookup_translators[model]
+    except KeyError:
+        return _lookup_translators.setdefault(model, LookupTranslator(model))
+
+
+class _MergeKey:
+    """
+    Sort key of a row for `heapq.merge`, comparing the ordering values
+    field by field with their own direction and NULL placement.
+    """
+
+    __slots__ = ('values', 'spec')
+
+    def __init__(self, values, spec):
+        self.values = values
+        self.spec = spec
+
+    def __lt__(self, other):
+        for a, b, (descending, nulls_largest) in zip(
+            self.values, other.values, self.spec
+        ):
+            if a is None or b is None:
+                if a is b:
+                    continue
+                result = 1 if (a is None) == nulls_largest else -1
+            elif a == b:
+                continue
+            else:
+                result = 1 if a > b else -1
+            if descending:
+                result = -result
+            return result < 0
+        return False
+
+
+def _merge_key_function(queryset):
+    """
+    Return the `heapq.merge` key function of the rows of `queryset`, or
+    None if it is not ordered.
+    """
+    query = queryset.query
+    ordering = query.order_by or (
+        query.default_ordering and queryset.model._meta.ordering
+    )
+    if not ordering:
+        return None
+    opts = queryset.model._meta
+    # PostgreSQL and Oracle sort NULLs as the largest values
+    nulls_largest = connections[queryset.db].vendor in ('postgresql', 'oracle')
+    attnames = []
+    spec = []
+    for item in ordering:
+        nulls = nulls_largest
+        if isinstance(item, str):
+            descending = item.startswith('-')
+            name = item.lstrip('-')
+        elif isinstance(getattr(item, 'expression', None), F):
+            descending = item.descending
+            name = item.expression.name
+            if item.nulls_first or item.nulls_last:
+                nulls = bool(item.nulls_last) != descending
+        else:
+            raise ValueError(f'split_tables() cannot order by {item!r}.')
+        if LOOKUP_SEP in name or name == '?':
+            raise ValueError(f'split_tables() cannot order by {name!r}.')
+        field = opts.pk if name == 'pk' else opts.get_field(name)
+        attnames.append((field.name, field.attname))
+        spec.append((descending, nulls))
+    spec = tuple(spec)
+
+    def key(row):
+        if isinstance(row, dict):
+            try:
+                values = [
+                    row[attname] if attname in row else row[name]
+                    for name, attname in attnames
+                ]
+            except KeyError as e:
+                raise ValueError(
+                    f'split_tables() needs the ordering field {e.args[0]!r} '
+                    f'in values().'
+                )
+        elif isinstance(row, models.Model):
+            values = [getattr(row, attname) for _, attname in attnames]
+        else:
+            raise ValueError('split_tables() cannot merge values_list() rows.')
+        return _MergeKey(values, spec)
+
+    return key
+
+
+class RoutedQuerySet(models.QuerySet):
+    """
+    Base queryset for the routed package tables.
+
+    Reads are resolved to the combined views by `RoutedQuery` and
+    inserts to the `_new` tables by `RoutedInsertQuery`, without
+    touching `Model._meta`. `update()` and `delete()` select the ids
+    through the view and write both the legacy and the new table.
+    """
+
+    _split_tables = False
+
+    def __init__(self, model=None, query=None, using=None, hints=None):
+        super().__init__(model, query or RoutedQuery(model), using, hints)
+
+    def _clone(self):
+        clone = super()._clone()
+        clone._split_tables = self._split_tables
+        return clone
 
     def _fetch_all(self):
-        """Ensure table names are rewritten before fetching results."""
-        self._result_cache = None  # Clear the cache
-        self.query.clear_ordering(
-            force_empty=True
-        )  # Clear ordering, which might rely on alias_map
-        self._rewrite_table_name()
-        super()._fetch_all()
-
-    def _as_sql(self, *args, **kwargs):
-        # Call the original method to get the SQL query
-        sql, params = super()._as_sql(*args, **kwargs)
-        # Replace the table name in the SQL query
-        sql = sql.replace('contracts_subscriptionpackage', 'combinedView')
-        sql = sql.replace('contracts_subscriptionpackage_services', 'combinedView')
+        if self._result_cache is None and self._split_tables:
+            self._result_cache = list(self._merged_tables())
+        if self._result_cache is None and tracer.enabled and tracer.sampled():
+            with tracer.trace(self):
+                super()._fetch_all()
+        else:
+            super()._fetch_all()
 
-        return sql, params
+    def split_tables(self):
+        """
+        Read the model's rows from its legacy and new tables with one
+        query each instead of through the combined view, so each query
+        can use the indexes of its table, and merge the results.
+
+        Both queries are ordered and limited to the end of the requested
+        slice; the rows are merged lazily with a k-way heap merge on the
+        queryset's ordering, with NULLs placed as the backend sorts
+        them, and the slice is applied to the merged stream. Ordering
+        must use the model's own fields, and the rows must be model
+        instances or `values()` dicts holding the ordering fields.
+        Joined routed tables are still read through their views.
+
+        `iterator()` streams the merged rows, and `count()` and
+        `exists()` query both tables; `aggregate()` is not supported.
+        """
+        clone = self._chain()
+        clone._split_tables = True
+        return clone
+
+    def _table_branches(self):
+        """
+        Return the querysets reading the legacy and the new table of a
+        split queryset.
+        """
+        branches = []
+        for mode in ('legacy', 'new'):
+            branch = self._chain()
+            branch._split_tables = False
+            # Prefetching is done once, on the merged rows
+            branch._prefetch_related_lookups = ()
+            branch.query.read_mode = mode
+            branches.append(branch)
+        return branches
+
+    def _merged_tables(self, chunk_size=None):
+        low, high = self.query.low_mark, self.query.high_mark
+        key = _merge_key_function(self)
+        branches = []
+        for branch in self._table_branches():
+            branch.query.clear_limits()
+            if high is not None:
+                branch.query.set_limits(high=high)
+            branches.append(branch.iterator(chunk_size))
+        if key is None:
+            merged = (row for branch in branches for row in branch)
+        else:
+            merged = heapq.merge(*branches, key=key)
+        return islice(merged, low, high)
+
+    def iterator(self, chunk_size=None):
+        if not self._split_tables:
+            return super().iterator(chunk_size)
+        if chunk_size is not None and chunk_size <= 0:
+            raise ValueError('Chunk size must be strictly positive.')
+        return self._split_iterator(chunk_size)
+
+    def _split_iterator(self, chunk_size):
+        rows = self._merged_tables(chunk_size)
+        if not self._prefetch_related_lookups or chunk_size is None:
+            yield from rows
+            return
+        while True:
+            results = list(islice(rows, chunk_size))
+            if not results:
+                return
+            prefetch_related_objects(results, *self._prefetch_related_lookups)
+            yield from results
+
+    def count(self):
+        if not self._split_tables or self._result_cache is not None:
+            return super().count()
+        if self.query.is_sliced or self.query.distinct:
+            return len(self)
+        return sum(branch.count() for branch in self._table_branches())
+
+    def exists(self):
+        if not self._split_tables or self._result_cache is not None:
+            return super().exists()
+        if self.query.is_sliced:
+            return bool(len(self))
+        return any(branch.exists() for branch in self._table_branches())
+
+    def aggregate(self, *args, **kwargs):
+        if self._split_tables:
+            raise NotSupportedError('split_tables() does not support aggregate().')
+        return super().aggregate(*args, **kwargs)
 
     def filter(self, *args, **kwargs):
+        """
+        Filter with lookups translated by the model's `LookupTranslator`.
+
+        `select`, `select_related` and `prefetch_related` keyword
+        arguments are applied to the queryset once instead of being
+        treated as lookups.
+        """
+        select = kwargs.pop('select', None)
+        select_related = kwargs.pop('select_related', None)
+        prefetch_related = kwargs.pop('prefetch_related', None)
+
+        translator = lookup_translator(self.model)
+        queryset = super().filter(
+            *translator.translate_args(args), **translator.translate_kwargs(kwargs)
+        )
+        if select:
+            queryset = queryset.extra(select=translator.translate_kwargs(select))
+        if select_related:
+            queryset = queryset.select_related(*select_related)
+        if prefetch_related:
+            queryset = queryset.prefetch_related(*prefetch_related)
+        return queryset
+
+    def _insert(
+        self, objs, fields, returning_fields=None, raw=False, using=None, **kwargs
+    ):
+        """
+        Insert the objects into the routed write table of the model.
+        """
+        self._for_write = True
+        if using is None:
+            using = self.db
+        pin_to_primary()
+        query = RoutedInsertQuery(self.model, **kwargs)
+        query.insert_values(fields, objs, raw=raw)
+        return query.get_compiler(using=using).execute_sql(returning_fields)
+
+    _insert.alters_data = True
+    _insert.queryset_only = False
+
+    def update(self, **kwargs):
+        """
+        Update the matching rows in both the legacy and the new table and
+        return the number of rows updated.
+
+        The ids are read through the view first, so filters may span
+        relations, and each table is then updated by id.
+        """
+        if not _routes_writes(self.model):
+            return super().update(**kwargs)
+        self._not_support_combined_queries('update')
+        if self.query.is_sliced:
+            raise TypeError('Cannot update a query once a slice has been taken.')
+        self._for_write = True
+        pin_to_primary()
+        with transaction.atomic(using=self.db, savepoint=False):
+            pks = list(self.order_by().values_list('pk', flat=True))
+            rows = RoutedUpdateQuery(self.model).update_batch(pks, kwargs, self.db)
+        self._result_cache = None
+        return rows
+
+    update.alters_data = True
+
+    def delete(self):
+        """
+        Delete the matching rows, and the rows cascading from them, from
+        both the legacy and the new table with a `RoutedCollector`.
+        """
+        if not _routes_writes(self.model):
+            return super().delete()
+        self._not_support_combined_queries('delete')
+        if self.query.is_sliced:
+            raise TypeError("Cannot use 'limit' or 'offset' with delete().")
+        if self.query.distinct or self.query.distinct_fields:
+            raise TypeError('Cannot call delete() after .distinct().')
+        if self._fields is not None:
+            raise TypeError('Cannot call delete() after .values() or .values_list()')
+
+        del_query = self._chain()
+        del_query._for_write = True
+        del_query.query.select_for_update = False
+        del_query.query.select_related = False
+        del_query.query.clear_ordering(force=True)
+
+        pin_to_primary()
+        collector = RoutedCollector(using=del_query.db, origin=self)
+        collector.collect(del_query)
+        deleted, rows_count = collector.delete()
+        self._result_cache = None
+        return deleted, rows_count
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def _raw_delete(self, using):
+        """
+        Delete the matching rows from both tables without cascading.
+        """
+        if not _routes_writes(self.model):
+            return super()._raw_delete(using)
+        pks = list(self.using(using).order_by().values_list('pk', flat=True))
+        return RoutedDeleteQuery(self.model).delete_batch(pks, using)
+
+    _raw_delete.alters_data = True
+
+
+class RoutedSaveMeta:
+    """
+    Per-model data used by routed saves, computed once when the model
+    class is prepared.
+
+    `fields`
+        The concrete fields written by an update (all but the primary
+        key).
+
+    `fields_by_name`
+        The same fields by name and by attname.
+
+    `set_fragments`
+        The `"column" = %s` SET fragment of each field, by attname.
+
+    `update_sql`
+        The full-row UPDATE statement of the legacy and the new table.
+    """
+
+    def __init__(self, model):
+        opts = model._meta
+        qn = connection.ops.quote_name
+        self.fields = tuple(
+            field for field in opts.concrete_fields if not field.primary_key
+        )
+        self.fields_by_name = {}
+        for field in self.fields:
+            self.fields_by_name[field.name] = field
+            self.fields_by_name[field.attname] = field
+        self.set_fragments = {
+            field.attname: f"{qn(field.column)} = %s" for field in self.fields
+        }
+        self.pk = opts.pk
+        self.table = routing_table.get(opts.db_table)
+        self.where_sql = f" WHERE {qn(opts.pk.column)} = %s"
+        self.update_prefix = {
+            db_table: f"UPDATE {qn(db_table)} SET " for db_table in self.table[:2]
+        }
+        full_set_clause = ", ".join(self.set_fragments.values())
+        self.update_sql = {
+            db_table: prefix + full_set_clause + self.where_sql
+            for db_table, prefix in self.update_prefix.items()
+        }
+
+    def update_statement(self, db_table, fields):
+        """
+        Return the UPDATE statement of `db_table` writing `fields`, whose
+        values are passed in the same order.
+        """
+        if tuple(fields) == self.fields:
+            return self.update_sql[db_table]
+        set_fragments = self.set_fragments
+        return (
+            self.update_prefix[db_table]
+            + ", ".join(set_fragments[field.attname] for field in fields)
+            + self.where_sql
+        )
+
+    def tables_for(self, db_table=None):
+        """
+        Return the physical tables a row is looked for in, most likely
+        first.
+
+        :param db_table: The table the row is known to live in, e.g.
+            because it was inserted or last updated there. Defaults to
+            the write table of the current routing scope, where new rows
+            go.
+        """
+        if db_table is None:
+            db_table = routing_table.current_write_map()[self.table.new]
+        if db_table == self.table.legacy:
+            return self.table.legacy, self.table.new
+        return self.table.new, self.table.legacy
+
+    def bulk_update_statement(self, db_table, fields, objs, connection):
+        """
+        Return the SQL and parameters updating `fields` of all `objs` in
+        `db_table` with one statement.
+
+        PostgreSQL joins the table with a typed `VALUES` list; other
+        backends use a `CASE` expression per field.
+        """
+        qn = connection.ops.quote_name
+        pk_column = qn(self.pk.column)
+        params = []
+        if connection.vendor == 'postgresql':
+            casts = [f"CAST(%s AS {self.pk.rel_db_type(connection)})"] + [
+                f"CAST(%s AS {field.cast_db_type(connection)})" for field in fields
+            ]
+            row = f"({', '.join(casts)})"
+            for obj in objs:
+                params.append(obj.pk)
+                params.extend(
+                    field.get_db_prep_save(getattr(obj, field.attname), connection)
+                    for field in fields
+                )
+            columns = ", ".join(qn(field.column) for field in fields)
+            set_clause = ", ".join(
+                f"{qn(field.column)} = v.{qn(field.column)}" for field in fields
+            )
+            sql = (
+                f"UPDATE {qn(db_table)} SET {set_clause} "
+                f"FROM (VALUES {', '.join([row] * len(objs))}) "
+                f"AS v ({pk_column}, {columns}) "
+                f"WHERE {qn(db_table)}.{pk_column} = v.{pk_column}"
+            )
+            return sql, params
+
+        set_fragments = []
+        for field in fields:
+            column = qn(field.column)
+            set_fragments.append(
+                f"{column} = CASE {pk_column} "
+                + " ".join(["WHEN %s THEN %s"] * len(objs))
+                + f" ELSE {column} END"
+            )
+            for obj in objs:
+                params.append(obj.pk)
+                params.append(
+                    field.get_db_prep_save(getattr(obj, field.attname), connection)
+                )
+        params.extend(obj.pk for obj in objs)
+        sql = (
+            f"UPDATE {qn(db_table)} SET {', '.join(set_fragments)} "
+            f"WHERE {pk_column} IN ({', '.join(['%s'] * len(objs))})"
+        )
+        return sql, params
+
+
+class RoutedModelMixin:
+    """
+    Sends inserts of the routed package models to their `_new` table
+    when `DB_ROUTING` is enabled, and updates to the legacy or new table
+    the row belongs to.
+
+    The column values are snapshotted when an instance is loaded or
+    inserted, so an update only writes the columns changed since. The
+    physical table an instance was inserted into or last updated in is
+    remembered as `_physical_table` and tried first by the next update.
+    Deletes remove the row from both tables through a `RoutedCollector`.
+
+    The models name their routed manager as `Meta.base_manager_name`, so
+    related object access and `refresh_from_db()` read the views too.
+    """
+
+    _routed_save_meta: RoutedSaveMeta
+    _physical_table = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            attname: value
+            for attname, value in zip(field_names, values)
+            if value is not DEFERRED
+        }
+        return instance
+
+    def _snapshot(self, fields):
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for field in fields:
+            loaded[field.attname] = getattr(self, field.attname)
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using, fields, **kwargs)
+        # The reloaded values, e.g. of a deferred field, are unchanged
+        meta = self._routed_save_meta
+        if fields is None:
+            fields = [field for field in meta.fields if field.attname in self.__dict__]
+        else:
+            fields = [
+                meta.fields_by_name[name]
+                for name in fields
+                if name in meta.fields_by_name
+            ]
+        self._snapshot(fields)
+
+    def _do_insert(self, manager, using, fields, returning_fields, raw):
+        if settings.DB_ROUTING == 1:
+            manager = RoutedQuerySet(self.__class__, using=using)
+            self._physical_table = routing_table.write_table(self.__class__)
+        results = super()._do_insert(manager, using, fields, returning_fields, raw)
+        self._snapshot(fields)
+        return results
+
+    def _routed_update(self, update_fields=None, using=None):
+        """
+        UPDATE the changed columns of the instance in the table it is
+        known to live in, or else the write table of the routing scope,
+        without reading the row first.
+
+        If the row is not in that table the other one is tried; if
+        neither has it, `DatabaseError` is raised.
+
+        :param update_fields: Names of the fields to write regardless of
+            whether they changed. Defaults to the changed fields, leaving
+            out deferred fields that were never loaded.
+        :param using: The database alias to write to. Defaults to the
+            one chosen by the routers, like `save()`.
+        """
+        meta = self._routed_save_meta
+        if update_fields is not None:
+            # In declaration order and without duplicates, as the SQL
+            # templates of `RoutedSaveMeta` expect
+            names = set(update_fields)
+            fields = [
+                field
+                for field in meta.fields
+                if field.name in names or field.attname in names
+            ]
+        else:
+            values = self.__dict__
+            loaded = values.get('_loaded_values')
+            # Deferred fields are missing from the instance dict, like in
+            # `get_deferred_fields()`; reading them would load each one.
+            fields = [
+                field
+                for field in meta.fields
+                if field.attname in values
+                and (
+                    loaded is None
+                    or field.attname not in loaded
+                    or loaded[field.attname] != values[field.attname]
+                )
+            ]
+        if not fields:
+            return
+
+        using = using or router.db_for_write(self.__class__, instance=self)
+        conn = connections[using]
+        values = [
+            field.get_db_prep_save(getattr(self, field.attname), conn)
+            for field in fields
+        ]
+        values.append(self.pk)
+
+        with conn.cursor() as cursor:
+            for db_table in meta.tables_for(self._physical_table):
+                cursor.execute(meta.update_statement(db_table, fields), values)
+                if cursor.rowcount:
+                    self._physical_table = db_table
+                    break
+            else:
+                raise DatabaseError(
+                    f"Update of {self._meta.label} {self.pk} did not affect any rows."
+                )
+        self._snapshot(fields)
+
+    def delete(self, using=None, keep_parents=False):
+        if not _routes_writes(self.__class__):
+            return super().delete(using, keep_parents)
+        if self.pk is None:
+            raise ValueError(
+                f"{self._meta.object_name} object can't be deleted because its "
+                f"{self._meta.pk.attname} attribute is set to None."
+            )
+        using = using or router.db_for_write(self.__class__, instance=self)
+        pin_to_primary()
+        collector = RoutedCollector(using=using, origin=self)
+        collector.collect([self], keep_parents=keep_parents)
+        return collector.delete()
+
+    delete.alters_data = True
+
+
+@receiver(class_prepared)
+def _prepare_routed_save_meta(sender, **kwargs):
+    if issubclass(sender, RoutedModelMixin):
+        sender._routed_save_meta = RoutedSaveMeta(sender)
+
+
+class RoutedBulkManagerMixin:
+    """
+    Manager-level `bulk_create` and `bulk_update` for the routed package
+    models when `DB_ROUTING` is enabled.
+
+    Inserts go to the write table of the current routing scope, like a
+    single `save()`, and set the generated ids on the objects. Updates
+    are partitioned by the table each object is known to live in,
+    defaulting to the write table of the scope, and fall back to the
+    other table for rows not found in the expected one. Both are done
+    in chunks of `batch_size` objects, defaulting to
+    `DB_ROUTED_BULK_BATCH_SIZE`.
+
+    The methods live on the manager only: querysets, and therefore the
+    many to many `add()` going through them, keep the stock behaviour.
+    """
+
+    def _routes_bulk_writes(self):
+        return _routes_writes(self.model)
+
+    def _bulk_batch_size(self, batch_size):
+        if batch_size is None:
+            batch_size = getattr(settings, 'DB_ROUTED_BULK_BATCH_SIZE', 1000)
+        if batch_size < 1:
+            raise ValueError('Batch size must be a positive integer.')
+        return batch_size
+
+    def bulk_create(self, objs, batch_size=None, **kwargs):
+        """
+        Insert `objs` into the routed write table with multi-row INSERTs
+        and return them with their generated ids set.
+        """
+        if not self._routes_bulk_writes():
+            return super().bulk_create(objs, batch_size=batch_size, **kwargs)
+        db_table = routing_table.write_table(self.model)
+        objs = RoutedQuerySet(self.model, using=self._db).bulk_create(
+            objs, batch_size=self._bulk_batch_size(batch_size), **kwargs
+        )
+        fields = self.model._routed_save_meta.fields
+        for obj in objs:
+            obj._snapshot(fields)
+            obj._physical_table = db_table
+        _invalidate_subscriptions(objs, self._db or router.db_for_write(self.model))
+        return objs
+
+    def bulk_update(self, objs, fields, batch_size=None):
+        """
+        Update `fields` of `objs` in the physical table each row lives in
+        and return the number of rows matched.
+
+        :param fields: Names of the fields to write.
+        """
+        if not self._routes_bulk_writes():
+            return super().bulk_update(objs, fields, batch_size=batch_size)
+        batch_size = self._bulk_batch_size(batch_size)
+        meta = self.model._routed_save_meta
+        try:
+            fields = [meta.fields_by_name[name] for name in fields]
+        except KeyError as e:
+            raise ValueError(
+                f'bulk_update() can only be used with concrete, non-primary '
+                f'key fields of {self.model._meta.label}, not {e.args[0]!r}.'
+            )
+        if not fields:
+            raise ValueError('Field names must be given to bulk_update().')
+        objs = list(objs)
+        if any(obj.pk is None for obj in objs):
+            raise ValueError('All bulk_update() objects must have a primary key set.')
+        if not objs:
+            return 0
+
+        partitions = {}
+        for obj in objs:
+            tables = meta.tables_for(obj._physical_table)
+            partitions.setdefault(tables, []).append(obj)
+
+        using = self._db or router.db_for_write(self.model)
+        conn = connections[using]
+        batch_size = min(
+            batch_size, conn.ops.bulk_batch_size(['pk', 'pk'] + fields, objs) or 1
+        )
+        pin_to_primary()
+        rows = 0
+        with transaction.atomic(using=using, savepoint=False):
+            with conn.cursor() as cursor:
+                for tables, partition in partitions.items():
+                    for start in range(0, len(partition), batch_size):
+                        batch = partition[start : start + batch_size]
+                        matched = 0
+                        for db_table in tables:
+                            sql, params = meta.bulk_update_statement(
+                                db_table, fields, batch, conn
+                            )
+                            cursor.execute(sql, params)
+                            matched += cursor.rowcount
+                            if matched >= len(batch):
+                                break
+                        rows += matched
+        for obj in objs:
+            obj._snapshot(fields)
+        _invalidate_subscriptions(objs, using)
+        return rows
+
+    bulk_create.alters_data = True
+    bulk_update.alters_data = True
+
+
+def _invalidate_subscriptions(objs, using):
+    for subscription_id in {getattr(obj, 'subscription_id', None) for obj in objs}:
+        invalidate_entitlements(subscription_id, using=using)
+
+
+def _deactivate_linked_services(
+    package_model, package_ids, deactivated_at, deactivated_by, keep_till, conn
+):
+    """
+    Deactivate all services linked to the given packages with one
+    set-based UPDATE per physical service table.
+
+    With `DB_ROUTING` enabled the links are read through their view and
+    both the legacy and the new service table are updated; otherwise
+    only the tables of the packages' own many to many relation are.
+    """
+    field = package_model._meta.get_field('services')
+    through = field.remote_field.through
+    service_opts = field.related_model._meta
+    link_table = through._meta.db_table
+    service_table = service_opts.db_table
+    if settings.DB_ROUTING == 1 and service_table in routing_table:
+        link_table = routing_table.read_table(through)
+        service_tables = routing_table.get(service_table)[:2]
+    else:
+        service_tables = (service_table,)
+
+    qn = conn.ops.quote_name
+    params = [
+        service_opts.get_field('deactivated_at').get_db_prep_save(deactivated_at, conn),
+        deactivated_by,
+        keep_till,
+        *package_ids,
+    ]
+    placeholders = ", ".join(["%s"] * len(package_ids))
+    pin_to_primary()
+    with conn.cursor() as cursor:
+        for db_table in service_tables:
+            cursor.execute(
+                f"UPDATE {qn(db_table)} SET {qn('deactivated_at')} = %s, "
+                f"{qn('deactivated_by')} = %s, {qn('keep_till')} = %s "
+                f"WHERE {qn(service_opts.pk.column)} IN ("
+                f"SELECT {qn(field.m2m_reverse_name())} FROM {qn(link_table)} "
+                f"WHERE {qn(field.m2m_column_name())} IN ({placeholders}))",
+                params,
+            )
+
+
+def _deactivate_package_services(package):
+    """
+    Deactivate all services linked to `package`, copying its
+    deactivation time, memo and `keep_till`.
+    """
+    using = router.db_for_write(package.__class__, instance=package)
+    _deactivate_linked_services(
+        package.__class__,
+        [package.pk],
+        package.deactivated_at,
+        package.deactivated_by,
+        package.keep_till,
+        connections[using],
+    )
+
+
+def _catalog_code(instance, field_name, kind):
+    """
+    Return the code of the catalog row `instance.<field_name>` refers
+    to, from the `product_catalog` when it knows the row.
+    """
+    code = product_catalog.code(kind, getattr(instance, f'{field_name}_id'))
+    if code is None:
+        code = getattr(instance, field_name).code
+    return code
+
+
+def _save_new_attributes(service, attrs):
+    """
+    Replace `service` by a new version carrying the given attributes.
+
+    All attribute codes are resolved through the `product_catalog`
+    before anything is written. The
+    deactivation of `service`, the new service, its links to all
+    packages of `service` and its attributes are then written in one
+    transaction, with one multi-row INSERT each for the links and the
+    attributes.
+    """
+    attrs = {code: value for code, value in attrs.items() if value}
+    ids = product_catalog.ids('attribute', attrs)
+    through = service.subscriptionpackage_set.through
+    switched_at = datetime_now()
+    with transaction.atomic(
+        using=router.db_for_write(service.__class__, instance=service)
+    ):
+        service.deactivate(deactivated_at=switched_at)
 
-        # Ensure that the db router is invoked properly
-        from django.db import router
-
-        router.db_for_read(self.model)  # Force router evaluation
-        # Replace `contracts_subscriptionpackage` with `combinedView` in the filter conditions
-        filters = {}
-
-        for key, value in kwargs.items():
-            # Modify the FK filters to replace the incorrect table reference
-            new_key = key.replace('contracts_subscriptionpackage', 'combinedView')
-            filters[new_key] = value
-            # Modify select related parts if select is used
-            if 'select' in kwargs:
-                select_fields = kwargs.get('select', {})
-                new_select_fields = {}
-                for field, value in select_fields.items():
-                    # Replace the table reference in the select fields
-                    new_field = field.replace(
-                        'contracts_subscriptionpackage', 'combinedView'
+        sps = SubscriptionPackageService.objects.create(
+            subscription_id=service.subscription_id,
+            service_id=service.service_id,
+            activated_at=switched_at,
+        )
+        # add new subscription package service to all subscription packages
+        through.objects.bulk_create(
+            [
+                through(
+                    subscriptionpackage_id=package_id, subscriptionpackageservice=sps
+                )
+                for package_id in service.subscriptionpackage_set.values_list(
+                    'pk', flat=True
+                )
+            ]
+        )
+        # create new attributes
+        SubscriptionPackageServiceAttribute.objects.bulk_create(
+            [
+                SubscriptionPackageServiceAttribute(
+                    subscription_package_service=sps,
+                    attribute_id=ids[code],
+                    value=value,
+                )
+                for code, value in attrs.items()
+            ]
+        )
+
+
+class LifecycleQuerySetMixin:
+    """
+    Chunked, set-based deactivation, suspension and resumption of the
+    rows of a package or service queryset.
+
+    The rows are walked in chunks of `chunk_size` ids in ascending id
+    order (keyset pagination, no OFFSET). Each chunk is updated in every
+    physical table the model is routed to and committed in its own
+    transaction. After each chunk `progress(last_id, count)` is called
+    with the last processed id and the number of rows processed so far;
+    passing that id as `start_after` resumes an interrupted run.
+
+    Querysets with `cascade_services` set (packages) also clear the
+    suspension and deactivate the services linked to each deactivated
+    package, like the per-instance `deactivate()`.
+
+    Routed models are updated in both their legacy and new table, other
+    models in their own table. The chunks are written to the database
+    of the queryset (`using()`), defaulting to the router's choice.
+    """
+
+    cascade_services = False
+
+    def _lifecycle_tables(self):
+        db_table = self.model._meta.db_table
+        if _routes_writes(self.model):
+            return routing_table.get(db_table)[:2]
+        return (db_table,)
+
+    def _run_chunked(self, apply, chunk_size, start_after, progress):
+        using = self._db or router.db_for_write(self.model)
+        conn = connections[using]
+        queryset = self.order_by('pk').values_list('pk', 'subscription_id')
+        last_id = start_after
+        count = 0
+        pin_to_primary()
+        while True:
+            with transaction.atomic(using=using):
+                chunk = queryset
+                if last_id is not None:
+                    chunk = chunk.filter(pk__gt=last_id)
+                rows = list(chunk[:chunk_size])
+                if not rows:
+                    break
+                apply(conn, rows)
+                for subscription_id in {row[1] for row in rows}:
+                    invalidate_entitlements(subscription_id, using=using)
+            last_id = rows[-1][0]
+            count += len(rows)
+            if progress is not None:
+                progress(last_id, count)
+        return count
+
+    def _update_rows(self, conn, assignments, params, ids):
+        qn = conn.ops.quote_name
+        set_clause = ", ".join(f"{qn(column)} = %s" for column in assignments)
+        placeholders = ", ".join(["%s"] * len(ids))
+        with conn.cursor() as cursor:
+            for db_table in self._lifecycle_tables():
+                cursor.execute(
+                    f"UPDATE {qn(db_table)} SET {set_clause} "
+                    f"WHERE {qn(self.model._meta.pk.column)} IN ({placeholders})",
+                    [*params, *ids],
+                )
+
+    def bulk_deactivate(
+        self,
+        deactivated_by: Optional[Memo] = None,
+        deactivated_at: Optional[datetime] = None,
+        package: Optional[Package] = None,
+        keep_till: Optional[int] = None,
+        chunk_size=1000,
+        start_after=None,
+        progress=None,
+    ):
+        """
+        Deactivate every row of the queryset and return the number of
+        rows processed.
+
+        :param deactivated_by: The possible memo which triggered the
+            change.
+        :param deactivated_at: Set deactivation time explicitly.
+            Otherwise use memos executed_at time or fall back to
+            current time.
+        :param package: Package to be deactivated, used for calculation
+            of keep_till partition value
+        :param keep_till: The value for retention of partition.
+            Calculated once per subscription of the run if None.
+        :param chunk_size: Number of rows per chunk and transaction.
+        :param start_after: Id of the last row processed by an earlier
+            run.
+        :param progress: Callable called with the last processed id and
+            the number of processed rows after each chunk.
+        """
+        deactivated_at = _action_time(deactivated_by, deactivated_at)
+        deactivated_by = deactivated_by.id if deactivated_by else None
+        subscription_model = self.model._meta.get_field('subscription').related_model
+        field = self.model._meta.get_field('deactivated_at')
+
+        def apply(conn, rows):
+            keep_tills = {}
+            if keep_till is None:
+                # Subscriptions seen in earlier chunks are not loaded again
+                missing = {
+                    row[1]
+                    for row in rows
+                    if context.key(row[1], package, deactivated_at)
+                    not in context.keep_tills
+                }
+                subscriptions = subscription_model._base_manager.using(
+                    conn.alias
+                ).in_bulk(missing)
+                for subscription in subscriptions.values():
+                    context.keep_till(subscription, package, deactivated_at)
+                for _, subscription_id in rows:
+                    keep_tills[subscription_id] = context.keep_tills[
+                        context.key(subscription_id, package, deactivated_at)
+                    ]
+            groups = {}
+            for pk, subscription_id in rows:
+                groups.setdefault(
+                    keep_till if keep_till is not None else keep_tills[subscription_id],
+                    [],
+                ).append(pk)
+            columns = ['deactivated_at', 'deactivated_by', 'keep_till']
+            if self.cascade_services:
+                # Packages drop their suspension, services keep it
+                columns.append('suspended_at')
+            prepared_at = field.get_db_prep_save(deactivated_at, conn)
+            for value, ids in groups.items():
+                params = [prepared_at, deactivated_by, value, None][: len(columns)]
+                self._update_rows(conn, columns, params, ids)
+                if self.cascade_services:
+                    _deactivate_linked_services(
+                        self.model, ids, deactivated_at, deactivated_by, value, conn
                     )
-                    new_select_fields[new_field] = value
-                kwargs['select'] = new_select_fields
-            # Handle the case where related fields might still reference the old table
-            if 'select_related' in kwargs:
-                select_related_fields = kwargs['select_related']
-                # Force router evaluation for all related models
-                for related_field in select_related_fields:
-                    related_model = self.model._meta.get_field(
-                        related_field
-                    ).related_model
-                    router.db_for_read(related_model)
-
-            if 'prefetch_related' in kwargs:
-                prefetch_related_fields = kwargs['prefetch_related']
-                # Force router evaluation for all related models
-                for related_field in prefetch_related_fields:
-                    related_model = self.model._meta.get_field(
-                        related_field
-                    ).related_model
-                    router.db_for_read(related_model)
-
-        return super().filter(*args, **filters)
-
-
-class SubscriptionPackageManager(models.Manager):
+
+        with lifecycle_operation() as context:
+            return self._run_chunked(apply, chunk_size, start_after, progress)
+
+    def bulk_suspend(
+        self,
+        deactivated_by: Optional[Memo] = None,
+        chunk_size=1000,
+        start_after=None,
+        progress=None,
+    ):
+        """
+        Suspend every row of the queryset and return the number of rows
+        processed. See `bulk_deactivate` for the chunking parameters.
+
+        :param deactivated_by: The possible memo which triggered the
+            change.
+        """
+        suspended_at = _action_time(deactivated_by)
+        field = self.model._meta.get_field('suspended_at')
+
+        def apply(conn, rows):
+            self._update_rows(
+                conn,
+                ('suspended_at',),
+                (field.get_db_prep_save(suspended_at, conn),),
+                [row[0] for row in rows],
+            )
+
+        return self._run_chunked(apply, chunk_size, start_after, progress)
+
+    def bulk_resume(self, chunk_size=1000, start_after=None, progress=None):
+        """
+        Remove the suspension of every row of the queryset and return
+        the number of rows processed. See `bulk_deactivate` for the
+        chunking parameters.
+        """
+
+        def apply(conn, rows):
+            self._update_rows(
+                conn, ('suspended_at',), (None,), [row[0] for row in rows]
+            )
+
+        return self._run_chunked(apply, chunk_size, start_after, progress)
+
+    bulk_deactivate.alters_data = True
+    bulk_suspend.alters_data = True
+    bulk_resume.alters_data = True
+
+
+KEYSET_ORDERINGS = (('pk',), ('activated_at', 'pk'))
+
+
+def keyset_iterator(queryset, order_by=('pk',), chunk_size=2000, fields=None):
+    """
+    Stream the rows of `queryset` in pages of `chunk_size` rows using
+    keyset pagination.
+
+    Every page is a separate query continuing after the ordering key of
+    the last row yielded, so it costs the same index range scan however
+    deep into the result it is, unlike OFFSET slicing. Pages are read
+    with `iterator()`, which uses a server-side cursor where the backend
+    supports one. Memory is bounded by one page.
+
+    :param order_by: One of `KEYSET_ORDERINGS`. The key must be unique
+        and not null, hence the trailing `pk`.
+    :param fields: Field names to yield as plain tuples instead of
+        model instances.
+    """
+    order_by = tuple(order_by)
+    if order_by not in KEYSET_ORDERINGS:
+        raise ValueError(f'Unsupported keyset ordering: {order_by!r}')
+    queryset = queryset.order_by(*order_by)
+    if fields is not None:
+        width = len(fields)
+        queryset = queryset.values_list(*fields, *order_by)
+    last = None
+    while True:
+        page = queryset
+        if last is not None:
+            if len(order_by) == 1:
+                page = page.filter(pk__gt=last[0])
+            else:
+                activated_at, pk = last
+                page = page.filter(
+                    Q(activated_at__gt=activated_at)
+                    | Q(activated_at=activated_at, pk__gt=pk)
+                )
+        count = 0
+        for row in page[:chunk_size].iterator(chunk_size=chunk_size):
+            count += 1
+            if fields is not None:
+                last = row[width:]
+                yield row[:width]
+            else:
+                last = tuple(getattr(row, name) for name in order_by)
+                yield row
+        if count < chunk_size:
+            return
+
+
+class ActiveUntil(Func):
+    """
+    `deactivated_at`, or the end of time for rows that were never
+    deactivated.
+
+    The end of time is inlined as a literal rather than bound as a
+    parameter, so the compiled expression is identical in queries and in
+    the expression indexes declared with it, and the planner can match
+    them.
+    """
+
+    function = 'COALESCE'
+    output_field = models.DateTimeField()
+    end_of_time = "'9999-12-31 23:59:59'"
+
+    def __init__(self, expression='deactivated_at', **extra):
+        super().__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return f'COALESCE({sql}, {self.end_of_time})', params
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        sql, params = compiler.compile(self.source_expressions[0])
+        return f"COALESCE({sql}, 'infinity'::timestamptz)", params
+
+
+class SubscriptionPackageQuerySet(LifecycleQuerySetMixin, RoutedQuerySet):
+    """Subscription packages read through `combinedView`."""
+
+    cascade_services = True
+
+
+class SubscriptionPackageTableQuerySet(LifecycleQuerySetMixin, models.QuerySet):
+    """Subscription packages read from the model's own table."""
+
+    cascade_services = True
+
+
+class SubscriptionPackageManager(RoutedBulkManagerMixin, models.Manager):
+    def get_queryset(self):
+        return SubscriptionPackageTableQuerySet(self.model, using=self._db)
+
     def active(self, include_suspended=False, *args, **kwargs):
+        """
+        Return the packages active now. Unless `include_suspended` is
+        set, packages with any `suspended_at`, including one in the future,
+        are left out.
+        """
+        result = self.as_of(datetime_now(), True, *args, **kwargs)
+        if not include_suspended:
+            return result.exclude(suspended_at__isnull=False)
+        return result
+
+    def as_of(self, ts, include_suspended=False, *args, **kwargs):
+        """
+        Return the packages active at the given point in time.
+
+        The deactivation check is a single range predicate on
+        `ActiveUntil()`, which the expression index of the old and the
+        new table serves, instead of an OR of a range and a NULL check.
+
+        :param ts: The point in time, which may lie in the past.
+        :param include_suspended: Also return packages suspended at `ts`.
+        """
         result = self.filter(
-            Q(activated_at__lte=datetime_now()),
-            Q(deactivated_at__isnull=True) | Q(deactivated_at__gt=datetime_now()),
+            GreaterThan(ActiveUntil(), ts),
             *args,
+            activated_at__lte=ts,
             **kwargs,
         )
         if not include_suspended:
-            return result.exclude(suspended_at__isnull=False)
+            return result.filter(
+                Q(suspended_at__gt=ts) | Q(suspended_at__isnull=True)
+            )
         return result
 
     def inactive(self, *args, **kwargs):
@@ -124,18 +1761,161 @@ class SubscriptionPackageManager(models.Manager):
             .values_list("package__code", flat=True)
         )
 
+    def active_package_code_list(self, include_suspended=False):
+        """
+        Return a list of the codes of the active packages, resolved
+        through the `product_catalog` instead of joining the package
+        table. Packages unknown to the catalog are loaded with one query.
+        """
+        package_ids = list(
+            self.active(include_suspended=include_suspended).values_list(
+                "package_id", flat=True
+            )
+        )
+        codes = {}
+        for package_id in package_ids:
+            code = product_catalog.code('package', package_id)
+            if code is not None:
+                codes[package_id] = code
+        missing = set(package_ids) - set(codes)
+        if missing:
+            for package in Package.objects.only('code').in_bulk(missing).values():
+                codes[package.pk] = package.code
+        return [codes[package_id] for package_id in package_ids]
+
+    def iter_keyset(self, order_by=('pk',), chunk_size=2000, fields=None):
+        """
+        Stream all packages with `keyset_iterator`, e.g. for exports.
+        """
+        return keyset_iterator(self.all(), order_by, chunk_size, fields)
+
+    def iter_active_package_codes(
+        self, subscription_ids, include_suspended=False, chunk_size=1000
+    ):
+        """
+        Stream the active package codes of many subscriptions.
+
+        The ids are consumed `chunk_size` at a time and every chunk is
+        resolved with a single set-based query, so memory stays bounded
+        by the chunk size however many ids are passed.
+
+        :param subscription_ids: Iterable of subscription ids.
+        :return: Iterator of mappings of subscription id to the set of
+            its active package codes, one mapping per chunk.
+        """
+        now = datetime_now()
+        subscription_ids = iter(subscription_ids)
+        while True:
+            chunk = list(islice(subscription_ids, chunk_size))
+            if not chunk:
+                return
+            codes = {subscription_id: set() for subscription_id in chunk}
+            rows = (
+                self.as_of(now, include_suspended)
+                .filter(subscription_id__in=chunk)
+                .values_list("subscription_id", "package__code")
+            )
+            for subscription_id, code in rows.iterator(chunk_size=chunk_size):
+                codes[subscription_id].add(code)
+            yield codes
+
+    def bulk_active_package_codes(
+        self, subscription_ids, include_suspended=False, chunk_size=1000
+    ):
+        """
+        Return a mapping of subscription id to the set of its active
+        package codes, queried `chunk_size` subscriptions at a time.
+        """
+        codes = {}
+        for chunk in self.iter_active_package_codes(
+            subscription_ids, include_suspended, chunk_size
+        ):
+            codes.update(chunk)
+        return codes
+
+    def load_product_tree(self, subscription_ids, active_only=False):
+        """
+        Load the packages, services and service attributes of many
+        subscriptions in three queries.
+
+        :param subscription_ids: Iterable of subscription ids.
+        :param active_only: Only load the currently active packages.
+        :return: Mapping of each subscription id to a list of package
+            dicts. Every package dict has a `services` list of service
+            dicts, and every service dict has an `attributes` mapping
+            of attribute code to value.
+        """
+        subscription_ids = list(subscription_ids)
+        tree = {subscription_id: [] for subscription_id in subscription_ids}
+        if not subscription_ids:
+            return tree
+
+        packages = {}
+        queryset = self.active() if active_only else self.all()
+        for package in queryset.filter(subscription_id__in=subscription_ids).values(
+            'id',
+            'subscription_id',
+            'package_id',
+            'package__code',
+            'activated_at',
+            'deactivated_at',
+            'suspended_at',
+            'fee',
+        ):
+            package['services'] = []
+            packages[package['id']] = package
+            tree[package['subscription_id']].append(package)
+        if not packages:
+            return tree
+
+        services = {}
+        for link in SubscriptionPackageLinkService.objects.filter(
+            subscriptionpackage_id__in=list(packages)
+        ).values(
+            'subscriptionpackage_id',
+            'subscriptionpackageservice_id',
+            'subscriptionpackageservice__service_id',
+            'subscriptionpackageservice__service__code',
+            'subscriptionpackageservice__activated_at',
+            'subscriptionpackageservice__deactivated_at',
+            'subscriptionpackageservice__suspended_at',
+        ):
+            service_id = link['subscriptionpackageservice_id']
+            service = services.get(service_id)
+            if service is None:
+                service = services[service_id] = {
+                    'id': service_id,
+                    'service_id': link['subscriptionpackageservice__service_id'],
+                    'service__code': link['subscriptionpackageservice__service__code'],
+                    'activated_at': link['subscriptionpackageservice__activated_at'],
+                    'deactivated_at': link[
+                        'subscriptionpackageservice__deactivated_at'
+                    ],
+                    'suspended_at': link['subscriptionpackageservice__suspended_at'],
+                    'attributes': {},
+                }
+            packages[link['subscriptionpackage_id']]['services'].append(service)
+        if not services:
+            return tree
+
+        for attribute in SubscriptionPackageServiceAttribute.objects.filter(
+            subscription_package_service_id__in=list(services)
+        ).values('subscription_package_service_id', 'attribute__code', 'value'):
+            services[attribute['subscription_package_service_id']]['attributes'][
+                attribute['attribute__code']
+            ] = attribute['value']
+        return tree
+
 
 class SubscriptionPackageManagerNew(SubscriptionPackageManager):
     def get_queryset(self):
-        # Ensure that the router is invoked here for the base model
-        router.db_for_read(self.model)
         # Return a custom queryset that operates on combinedView
         return SubscriptionPackageQuerySet(self.model, using=self._db)
 
 
 
 
-class SubscriptionPackage(DWHDumpable):
+class SubscriptionPackage(RoutedModelMixin, DWHDumpable):
     """
     Replaces Subscription.packages many to many relationship with
     join table which provides information about past packages,
@@ -220,64 +2000,14 @@ class SubscriptionPackage(DWHDumpable):
     keep_till = models.IntegerField(default=999)
 
     def save(self, *args, **kwargs):
+        # Read this write back from the primary for the rest of the request
+        pin_to_primary()
         if settings.DB_ROUTING == 1:
             if self.pk:
-                # If args are provided, use the fields in args; otherwise, fallback to all model fields
-                if args:
-                    fields = args[0]  # Use the provided list in args
-                else:
-                    fields = [
-                        field.name for field in self._meta.get_fields()
-                    ]  # Fallback to all fields
-
-                # Iterate through the fields
-                fields_to_update = {}
-                for field_name in fields:
-                    # Check if the field exists on the model
-                    if hasattr(self, field_name):
-                        field_value = getattr(self, field_name)
-
-                        # Get the actual field object by field name
-                        field = self._meta.get_field(field_name)
-
-                        # Skip ManyToManyFields
-                        if isinstance(field, models.ManyToManyField) or isinstance(
-                            field, models.ManyToOneRel
-                        ):
-                            continue  # Skip processing ManyToMany fields
-
-                        # Check if the field is a ForeignKey
-                        if isinstance(field, models.ForeignKey):
-                            # Get the ForeignKey ID instead of the object
-                            fk_value = getattr(self, field_name + "_id")
-                            fields_to_update[field_name + "_id"] = fk_value
-                        else:
-                            # For non-ForeignKey fields, store the value
-                            fields_to_update[field_name] = field_value
-
-                if fields_to_update:
-                    set_clause = ", ".join(
-                        [f"{field} = %s" for field in fields_to_update.keys()]
-                    )
-                    values = list(fields_to_update.values())
-                    values.append(
-                        self.id
-                    )  # Add the id to the values list for the WHERE clause
-
-                    if self.keep_till < 1000:
-                        old_instance = SubscriptionPackage.objects.filter(
-                            id=self.id
-                        ).first()
-                        if old_instance:
-                            sql_query = f"UPDATE contracts_subscriptionpackage SET {set_clause} WHERE id = %s"
-                    else:
-                        new_instance = SubscriptionPackageNew.objects.filter(
-                            id=self.id
-                        ).first()
-                        if new_instance:
-                            sql_query = f"UPDATE contracts_subscriptionpackage_new SET {set_clause} WHERE id = %s"
-                    with connection.cursor() as cursor:
-                        cursor.execute(sql_query, values)
+                self._routed_update(
+                    args[0] if args else kwargs.get('update_fields'),
+                    using=kwargs.get('using'),
+                )
 
             else:
                 try:
@@ -293,6 +2023,10 @@ class SubscriptionPackage(DWHDumpable):
             except Exception as e:
                 logging.error(f"Error during saving the old instance: {str(e)}")
                 raise
+        invalidate_entitlements(
+            self.subscription_id,
+            using=router.db_for_write(self.__class__, instance=self),
+        )
 
     def deactivate(
         self,
@@ -316,20 +2050,15 @@ class SubscriptionPackage(DWHDumpable):
         self.deactivated_by = deactivated_by.id if deactivated_by else None
         if self.keep_till is None:
             if keep_till is None:
-                self.keep_till = self.subscription.calculate_keep_till(
-                    package, self.deactivated_at
-                )
+                self.keep_till = calculate_keep_till(self, package, self.deactivated_at)
             else:
                 self.keep_till = keep_till
         self.suspended_at = None
-        for service in self.services.all():
-            service.deactivate(
-                deactivated_by,
-                deactivated_at=self.deactivated_at,
-                package=package,
-                keep_till=self.keep_till,
-            )
-        self.save()
+        with transaction.atomic(
+            using=router.db_for_write(self.__class__, instance=self)
+        ):
+            _deactivate_package_services(self)
+            self.save()
 
     def suspend(self, deactivated_by: Optional[Memo] = None):
         """
@@ -351,192 +2080,75 @@ class SubscriptionPackage(DWHDumpable):
 
     def __str__(self):
         return '{},activated_at={},deactivated_at={}'.format(
-            self.package.code, self.activated_at, self.deactivated_at
+            _catalog_code(self, 'package', 'package'),
+            self.activated_at,
+            self.deactivated_at,
         )
 
     class Meta:
         indexes = [
             models.Index(fields=['-activated_at']),
             models.Index(fields=['-deactivated_at']),
+            models.Index(ActiveUntil(), name='subpkg_active_until'),
         ]
+        base_manager_name = 'objects'
 
-def replace_table_name(old_name):
-    """
-    Replace the old table name with the new view table name.
-    This function is used for dynamic table name replacements.
-    """
-    replacements = {
-        "contracts_subscriptionpackage_services": "view_contracts_subscriptionpackage_services",
-        "contracts_subscriptionpackageservice": "view_contracts_subscriptionpackageservice",
-        "contracts_subscriptionpackage_services_new": "view_contracts_subscriptionpackage_services",
-        "contracts_subscriptionpackageservice_new": "view_contracts_subscriptionpackageservice",
-    }
-
-    return replacements.get(
-        old_name, old_name
-    )  # Return the new name or the original name if no replacement found.
-
-class PackageServiceQuerySet(models.QuerySet):
-    def _rewrite_alias_map(self):
-        """
-        Update alias_map table names dynamically to use view tables.
-        """
-        for alias, table in self.query.alias_map.items():
-            original_name = table.table_name
-            table.table_name = replace_table_name(table.table_name)
-            print(f"Rewriting Alias: {alias} -> {original_name} to {table.table_name}")
-
-    def _rewrite_where(self, where_clause):
-        """
-        Recursively rewrite table names in the WHERE clause.
-        """
-        if hasattr(where_clause, 'children'):
-            for child in where_clause.children:
-                self._rewrite_where(child)
-                if hasattr(child, 'lhs') and hasattr(child.lhs, 'target'):
-                    child.lhs.target.model._meta.db_table = replace_table_name(
-                        child.lhs.target.model._meta.db_table
-                    )
-                if hasattr(child, 'rhs') and isinstance(child.rhs, str):
-                    child.rhs = replace_table_name(child.rhs)
-
-        where_clause = self._rewrite_where_clause(where_clause)
-        return where_clause
-
-    def _rewrite_where_clause(self, where_clause):
-        """
-        Handle table replacements in the WHERE clause expression.
-        """
-        if isinstance(where_clause, Q):
-            for child in where_clause.children:
-                self._rewrite_where(child)
-
-        # Replace table names in the WHERE clause expression
-        if isinstance(where_clause, Lookup):
-            self._rewrite_lookup(where_clause)
-
-        return where_clause
 
-    def _rewrite_lookup(self, lookup):
-        """
-        Handle the replacement of table names in a Lookup expression.
-        """
-        if hasattr(lookup.lhs, 'model'):
-            # Rewrite the table name in the left-hand side model
-            lookup.lhs.model._meta.db_table = replace_table_name(
-                lookup.lhs.model._meta.db_table
-            )
+class PackageServiceQuerySet(LifecycleQuerySetMixin, RoutedQuerySet):
+    """Subscription package services read through their view."""
 
-        if isinstance(lookup.rhs, str):
-            # If the right-hand side is a string, replace the table name
-            lookup.rhs = replace_table_name(lookup.rhs)
 
-        return lookup
+class PackageServiceTableQuerySet(LifecycleQuerySetMixin, models.QuerySet):
+    """Subscription package services read from the model's own table."""
 
-    def _rewrite_expression(self, expression):
-        """
-        Rewrite the table names in complex expressions like F() expressions.
-        """
-        if isinstance(expression, F):
-            if hasattr(expression, 'target'):
-                expression.target.model._meta.db_table = replace_table_name(
-                    expression.target.model._meta.db_table
-                )
 
-        return expression
+class PackageServiceManager(RoutedBulkManagerMixin, models.Manager):
+    def get_queryset(self):
+        return PackageServiceTableQuerySet(self.model, using=self._db)
 
-    def _fetch_all(self):
+    def active(self, include_suspended=False, *args, **kwargs):
         """
-        Ensure table names are rewritten before fetching query results.
+        Return the services active now. Unless `include_suspended` is
+        set, services with any `suspended_at`, including one in the future,
+        are left out.
         """
-        if not self._result_cache:
-            print(f"query before rewrite : {self.query}")
-            self._rewrite_alias_map()
-            self._rewrite_where(self.query.where)
-            print(f"query after rewrite : {self.query}")
-
-        super()._fetch_all()
-
-    def filter(self, *args, **kwargs):
-        # Log the original query parameters
-        print(f"Original filter kwargs: {kwargs}")
-
-        # Replace table names in the filter kwargs to ensure the correct table names are used
-        new_kwargs = {}
-
-        # Loop through the kwargs to replace table names in the keys
-        for key, value in kwargs.items():
-            # If the key contains a table reference (e.g., 'contracts_subscriptionpackage_services')
-            new_key = replace_table_name(
-                key
-            )  # Replace the table name in the filter key
-            new_kwargs[
-                new_key
-            ] = value  # Add the modified key and value to the new kwargs
-
-        # Log the updated query parameters
-        print(f"Updated filter kwargs: {new_kwargs}")
-
-        # Call the parent `filter` method with the updated kwargs
-        return super().filter(*args, **new_kwargs)
+        result = self.as_of(datetime_now(), True, *args, **kwargs)
+        if not include_suspended:
+            return result.exclude(suspended_at__isnull=False)
+        return result
 
-    def _rewrite_filters(self, kwargs):
-        """
-        Update filter arguments dynamically to replace table names.
+    def as_of(self, ts, include_suspended=False, *args, **kwargs):
         """
-        updated_kwargs = {}
-
-        for field, value in kwargs.items():
-            if isinstance(value, list):
-                # Handle cases where the filter value is a list (e.g., 'subscriptionpackage__in')
-                updated_value = [self._replace_table_names(val) for val in value]
-            else:
-                # Handle other cases of filter values
-                updated_value = self._replace_table_names(value)
+        Return the services active at the given point in time.
 
-            updated_kwargs[field] = updated_value
-        return updated_kwargs
+        The deactivation check is a single range predicate on
+        `ActiveUntil()`, which the expression index of the old and the
+        new table serves, instead of an OR of a range and a NULL check.
 
-    def _replace_table_names(self, value):
+        :param ts: The point in time, which may lie in the past.
+        :param include_suspended: Also return services suspended at `ts`.
         """
-        Replace table names in the filter value (could be Q, Lookup, or string).
-        """
-        if isinstance(value, Q):
-            # If it's a Q object, replace table names recursively in its children
-            value = value.children
-            value = [self._replace_table_names(val) for val in value]
-        elif isinstance(value, Lookup):
-            # Handle replacements in Lookup objects
-            self._rewrite_lookup(value)
-        elif isinstance(value, str):
-            # If it's a string, replace any table names in it
-            value = replace_table_name(value)
-        return value
-
-    def get_prefetch_queryset(self, instances, related_objects, queryset):
-        """
-        Ensure prefetch queries also use the rewritten table names.
-        """
-        queryset._rewrite_alias_map()
-        queryset._rewrite_where(queryset.query.where)
-        return super().get_prefetch_queryset(instances, related_objects, queryset)
-
-
-class PackageServiceManager(models.Manager):
-    def active(self, include_suspended=False, *args, **kwargs):
         result = self.filter(
-            Q(activated_at__lte=datetime_now()),
-            Q(deactivated_at__isnull=True) | Q(deactivated_at__gt=datetime_now()),
+            GreaterThan(ActiveUntil(), ts),
             *args,
+            activated_at__lte=ts,
             **kwargs,
         )
         if not include_suspended:
-            return result.exclude(suspended_at__isnull=False)
+            return result.filter(
+                Q(suspended_at__gt=ts) | Q(suspended_at__isnull=True)
+            )
         return result
 
     def inactive(self, *args, **kwargs):
         return self.filter(deactivated_at__lte=datetime_now(), *args, **kwargs)
 
+    def iter_keyset(self, order_by=('pk',), chunk_size=2000, fields=None):
+        """
+        Stream all services with `keyset_iterator`, e.g. for exports.
+        """
+        return keyset_iterator(self.all(), order_by, chunk_size, fields)
+
     def active_package_codes(self, include_suspended=False, *args, **kwargs):
         return (
             self.active(include_suspended=include_suspended)
@@ -547,16 +2159,11 @@ class PackageServiceManager(models.Manager):
 
 class PackageServiceManagerNew(PackageServiceManager):
     def get_queryset(self):
-        # Ensure that the router is invoked here for the base model
-        router.db_for_read(self.model)
         # Return a custom queryset that operates on combinedView
-        queryset = PackageServiceQuerySet(self.model, using=self._db)
-        # Return the modified queryset
-        # queryset._rewrite_table_name()
-        return queryset
+        return PackageServiceQuerySet(self.model, using=self._db)
 
 
-class SubscriptionPackageService(DWHDumpable):
+class SubscriptionPackageService(RoutedModelMixin, DWHDumpable):
     """
     `activated_by`
         The memo id which issued the change. This can
@@ -595,69 +2202,24 @@ class SubscriptionPackageService(DWHDumpable):
     suspended_at = models.DateTimeField(default=None, null=True)
     keep_till = models.IntegerField(default=999)
 
+    class Meta:
+        indexes = [
+            models.Index(ActiveUntil(), name='subpkgservice_active_until'),
+        ]
+        base_manager_name = 'objects'
+
     def save(self, *args, **kwargs):
+        # Read this write back from the primary for the rest of the request
+        pin_to_primary()
         if settings.DB_ROUTING == 1:
             if self.pk:
-                # If args are provided, use the fields in args; otherwise, fallback to all model fields
-                if args:
-                    fields = args[0]  # Use the provided list in args
-                else:
-                    fields = [
-                        field.name for field in self._meta.get_fields()
-                    ]  # Fallback to all fields
-
-                # Iterate through the fields
-                fields_to_update = {}
-                for field_name in fields:
-                    # Check if the field exists on the model
-                    if hasattr(self, field_name):
-                        field_value = getattr(self, field_name)
-
-                        # Get the actual field object by field name
-                        field = self._meta.get_field(field_name)
-
-                        # Skip ManyToManyFields
-                        if isinstance(field, models.ManyToManyField) or isinstance(
-                            field, models.ManyToOneRel
-                        ):
-                            continue  # Skip processing ManyToMany fields
-
-                        # Check if the field is a ForeignKey
-                        if isinstance(field, models.ForeignKey):
-                            # Get the ForeignKey ID instead of the object
-                            fk_value = getattr(self, field_name + "_id")
-                            fields_to_update[field_name + "_id"] = fk_value
-                        else:
-                            # For non-ForeignKey fields, store the value
-                            fields_to_update[field_name] = field_value
-                # If there are fields to update, build and execute the SQL query
-                if fields_to_update:
-                    set_clause = ", ".join(
-                        [f"{field} = %s" for field in fields_to_update.keys()]
-                    )
-                    values = list(fields_to_update.values())
-                    values.append(
-                        self.id
-                    )  # Add the id to the values list for the WHERE clause
-
-                    if self.keep_till < 1000:
-                        old_instance = SubscriptionPackageService.objects.filter(
-                            id=self.id
-                        ).first()
-                        if old_instance:
-                            sql_query = f"UPDATE contracts_subscriptionpackageservice SET {set_clause} WHERE id = %s"
-                    else:
-                        new_instance = SubscriptionPackageServiceNew.objects.filter(
-                            id=self.id
-                        ).first()
-                        if new_instance:
-                            sql_query = f"UPDATE contracts_subscriptionpackageservice_new SET {set_clause} WHERE id = %s"
-                    with connection.cursor() as cursor:
-                        cursor.execute(sql_query, values)
+                self._routed_update(
+                    args[0] if args else kwargs.get('update_fields'),
+                    using=kwargs.get('using'),
+                )
 
             else:
                 try:
-                    self._meta.db_table = 'contracts_subscriptionpackageservice_new'
                     super().save(*args, **kwargs)
 
                 except Exception as e:
@@ -670,6 +2232,10 @@ class SubscriptionPackageService(DWHDumpable):
             except Exception as e:
                 logging.error(f"Error during saving the old instance: {str(e)}")
                 raise
+        invalidate_entitlements(
+            self.subscription_id,
+            using=router.db_for_write(self.__class__, instance=self),
+        )
 
     def deactivate(
         self,
@@ -691,10 +2257,8 @@ class SubscriptionPackageService(DWHDumpable):
         """
         self.deactivated_at = _action_time(deactivated_by, deactivated_at)
         self.deactivated_by = deactivated_by.id if deactivated_by else None
-        if not keep_till:
-            self.keep_till = self.subscription.calculate_keep_till(
-                package, self.deactivated_at
-            )
+        if keep_till is None:
+            self.keep_till = calculate_keep_till(self, package, self.deactivated_at)
         else:
             self.keep_till = keep_till
         self.save()
@@ -707,25 +2271,7 @@ class SubscriptionPackageService(DWHDumpable):
             key must be a attribute code
             value must be attribute value
         """
-        switched_at = datetime_now()
-        self.deactivate(deactivated_at=switched_at)
-
-        sps = SubscriptionPackageService.objects.create(
-            subscription=self.subscription,
-            service=self.service,
-            activated_at=switched_at,
-        )
-        # add new subscription package service to all subscription packages
-        for spkg in self.subscriptionpackage_set.all():
-            spkg.services.add(sps)
-        # create new attributes
-        for attr_code, value in attrs.items():
-            if not value:
-                continue
-            attr = pc.ServiceAttribute.objects.get(code=attr_code)
-            SubscriptionPackageServiceAttribute.objects.create(
-                subscription_package_service=sps, attribute=attr, value=value
-            )
+        _save_new_attributes(self, attrs)
 
     def suspend(self, deactivated_by: Optional[Memo] = None):
         """
@@ -747,132 +2293,23 @@ class SubscriptionPackageService(DWHDumpable):
 
     def __str__(self):
         return 'service={},activated_at={},deactivated_at={}'.format(
-            self.service.code, self.activated_at, self.deactivated_at
+            _catalog_code(self, 'service', 'service'),
+            self.activated_at,
+            self.deactivated_at,
         )
 
 
-class SubscriptionPackageLinkServiceQuerySet(models.QuerySet):
-    def _rewrite_table_name(self):
-        """Rewrite the table names dynamically in the query alias map."""
-        if not hasattr(self.query, "alias_map"):
-            return  # Skip if alias_map is not available (e.g., raw queries)
-
-        for alias, table in self.query.alias_map.items():
-            if table.table_name == 'contracts_subscriptionpackage_services':
-                table.table_name = 'view_contracts_subscriptionpackage_services'
-            if table.table_name == 'contracts_subscriptionpackageservice':
-                table.table_name = 'view_contracts_subscriptionpackageservice'
-        # Rewrite explicit table names in WHERE conditions (if required)
-        if hasattr(self.query, "where"):
-            self._rewrite_where(self.query.where)
-
-    def _rewrite_where(self, where_clause):
-        """Recursively rewrite table names in the WHERE clause."""
-        if hasattr(where_clause, "children"):
-            for child in where_clause.children:
-                if hasattr(child, "lhs") and hasattr(child.lhs, "target"):
-                    # Check if the child is a reference to a table/column
-                    table_name = child.lhs.target.model._meta.db_table
-                    if table_name == 'contracts_subscriptionpackage_services':
-                        child.lhs.target.model._meta.db_table = (
-                            'view_contracts_subscriptionpackage_services'
-                        )
-                    elif table_name == 'contracts_subscriptionpackageservice':
-                        child.lhs.target.model._meta.db_table = (
-                            'view_contracts_subscriptionpackageservice'
-                        )
-
-                # Handle nested conditions
-                if hasattr(child, "children"):
-                    self._rewrite_where(child)
-
-    def _as_sql(self, *args, **kwargs):
-        # Call the original method to get the SQL query
-        sql, params = super()._as_sql(*args, **kwargs)
-        # Replace the table name in the SQL query
-        sql = sql.replace(
-            'contracts_subscriptionpackageservice',
-            'view_contracts_subscriptionpackageservice',
-        )
-        sql = sql.replace(
-            'contracts_subscriptionpackage_services',
-            'view_contracts_subscriptionpackage_services',
-        )
+class SubscriptionPackageLinkServiceQuerySet(RoutedQuerySet):
+    """Package to service links read through their view."""
 
-        return sql, params
-
-    def _fetch_all(self):
-        """Ensure table names are rewritten before fetching results."""
-        self._result_cache = None  # Clear the cache
-        self.query.clear_ordering(
-            force_empty=True
-        )  # Clear ordering, which might rely on alias_map
-        self._rewrite_table_name()
-        super()._fetch_all()
 
-    def filter(self, *args, **kwargs):
-        
-        router.db_for_read(self.model)  # Force router evaluation
-        # Replace `contracts_subscriptionpackage` with `combinedView` in the filter conditions
-        filters = {}
-
-        for key, value in kwargs.items():
-            # Modify the FK filters to replace the incorrect table reference
-            new_key = key.replace(
-                'contracts_subscriptionpackage_services',
-                'view_contracts_subscriptionpackage_services',
-            )
-            filters[new_key] = value
-            # Modify select related parts if select is used
-            if 'select' in kwargs:
-                select_fields = kwargs.get('select', {})
-                new_select_fields = {}
-                for field, value in select_fields.items():
-                    # Replace the table reference in the select fields
-                    new_field = field.replace(
-                        'contracts_subscriptionpackage_services',
-                        'view_contracts_subscriptionpackage_services',
-                    )
-                    new_select_fields[new_field] = value
-                kwargs['select'] = new_select_fields
-            # Handle the case where related fields might still reference the old table
-            if 'select_related' in kwargs:
-                select_related_fields = kwargs['select_related']
-                # Force router evaluation for all related models
-                for related_field in select_related_fields:
-                    related_model = self.model._meta.get_field(
-                        related_field
-                    ).related_model
-                    router.db_for_read(related_model)
-
-            if 'prefetch_related' in kwargs:
-                prefetch_related_fields = kwargs['prefetch_related']
-                # Force router evaluation for all related models
-                for related_field in prefetch_related_fields:
-                    related_model = self.model._meta.get_field(
-                        related_field
-                    ).related_model
-                    router.db_for_read(related_model)
-
-        return super().filter(*args, **filters)
-
-    def get_prefetch_queryset(self, related_objects, instance):
-        """Override the method to rewrite table names for the prefetch related fields."""
-        queryset = super().get_prefetch_queryset(related_objects, instance)
-        # Rewrite the table names in the related query
-        queryset._rewrite_table_name()
-        return queryset
-
-
-class SubscriptionPackageLinkServiceManager(models.Manager):
+class SubscriptionPackageLinkServiceManager(RoutedBulkManagerMixin, models.Manager):
     def get_queryset(self):
-        # Ensure that the router is invoked here for the base model
-        router.db_for_read(self.model)
         # Return a custom queryset that operates on combinedView
         return SubscriptionPackageLinkServiceQuerySet(self.model, using=self._db)
 
 
-class SubscriptionPackageLinkService(models.Model):
+class SubscriptionPackageLinkService(RoutedModelMixin, models.Model):
     subscriptionpackage = models.ForeignKey(
         SubscriptionPackage, on_delete=models.CASCADE, db_constraint=False
     )
@@ -886,71 +2323,20 @@ class SubscriptionPackageLinkService(models.Model):
 
     class Meta:
         db_table = 'contracts_subscriptionpackage_services'
+        base_manager_name = 'objects'
 
     def save(self, *args, **kwargs):
+        # Read this write back from the primary for the rest of the request
+        pin_to_primary()
         if settings.DB_ROUTING == 1:
             if self.pk:
-                # If args are provided, use the fields in args; otherwise, fallback to all model fields
-                if args:
-                    fields = args[0]  # Use the provided list in args
-                else:
-                    fields = [
-                        field.name for field in self._meta.get_fields()
-                    ]  # Fallback to all fields
-
-                # Iterate through the fields
-                fields_to_update = {}
-                for field_name in fields:
-                    # Check if the field exists on the model
-                    if hasattr(self, field_name):
-                        field_value = getattr(self, field_name)
-
-                        # Get the actual field object by field name
-                        field = self._meta.get_field(field_name)
-
-                        # Skip ManyToManyFields
-                        if isinstance(field, models.ManyToManyField) or isinstance(
-                            field, models.ManyToOneRel
-                        ):
-                            continue  # Skip processing ManyToMany fields
-
-                        # Check if the field is a ForeignKey
-                        if isinstance(field, models.ForeignKey):
-                            # Get the ForeignKey ID instead of the object
-                            fk_value = getattr(self, field_name + "_id")
-                            fields_to_update[field_name + "_id"] = fk_value
-                        else:
-                            # For non-ForeignKey fields, store the value
-                            fields_to_update[field_name] = field_value
-
-                # If there are fields to update, build and execute the SQL query
-                if fields_to_update:
-                    set_clause = ", ".join(
-                        [f"{field} = %s" for field in fields_to_update.keys()]
-                    )
-                    values = list(fields_to_update.values())
-                    values.append(
-                        self.id
-                    )  # Add the id to the values list for the WHERE clause
-
-                    if self.keep_till < 1000:
-                        old_instance = SubscriptionPackageLinkService.objects.filter(
-                            id=self.id
-                        ).first()
-                        if old_instance:
-                            sql_query = f"UPDATE contracts_subscriptionpackage_services SET {set_clause} WHERE id = %s"
-                    else:
-                        new_instance = SubscriptionPackageNew.objects.filter(
-                            id=self.id
-                        ).first()
-                        if new_instance:
-                            sql_query = f"UPDATE contracts_subscriptionpackage_services_new SET {set_clause} WHERE id = %s"
-                    with connection.cursor() as cursor:
-                        cursor.execute(sql_query, values)
+                self._routed_update(
+                    args[0] if args else kwargs.get('update_fields'),
+                    using=kwargs.get('using'),
+                )
 
             else:
                 try:
-                    self._meta.db_table = 'contracts_subscriptionpackage_services_new'
                     super().save(*args, **kwargs)
 
                 except Exception as e:
@@ -965,69 +2351,15 @@ class SubscriptionPackageLinkService(models.Model):
                 raise
 
 
-class SubscriptionPackageServiceAttributeQuerySet(models.QuerySet):
-    def _as_sql(self, *args, **kwargs):
-        # Call the original method to get the SQL query
-        sql, params = super()._as_sql(*args, **kwargs)
-        # Replace the table name in the SQL query
-        sql = sql.replace(
-            'contracts_subscriptionpackage_services',
-            'view_contracts_subscriptionpackage_services',
-        )
-        return sql, params
-
-    def filter(self, *args, **kwargs):
+class SubscriptionPackageServiceAttributeQuerySet(RoutedQuerySet):
+    """Service attributes read through their view."""
 
-        router.db_for_read(self.model)  # Force router evaluation
-        # Replace `contracts_subscriptionpackage` with `combinedView` in the filter conditions
-        filters = {}
 
-        for key, value in kwargs.items():
-            # Modify the FK filters to replace the incorrect table reference
-            new_key = key.replace(
-                'contracts_subscriptionpackage_services',
-                'view_contracts_subscriptionpackage_services',
-            )
-            filters[new_key] = value
-            # Modify select related parts if select is used
-            if 'select' in kwargs:
-                select_fields = kwargs.get('select', {})
-                new_select_fields = {}
-                for field, value in select_fields.items():
-                    # Replace the table reference in the select fields
-                    new_field = field.replace(
-                        'contracts_subscriptionpackage_services',
-                        'view_contracts_subscriptionpackage_services',
-                    )
-                    new_select_fields[new_field] = value
-                kwargs['select'] = new_select_fields
-            # Handle the case where related fields might still reference the old table
-            if 'select_related' in kwargs:
-                select_related_fields = kwargs['select_related']
-                # Force router evaluation for all related models
-                for related_field in select_related_fields:
-                    related_model = self.model._meta.get_field(
-                        related_field
-                    ).related_model
-                    router.db_for_read(related_model)
-
-            if 'prefetch_related' in kwargs:
-                prefetch_related_fields = kwargs['prefetch_related']
-                # Force router evaluation for all related models
-                for related_field in prefetch_related_fields:
-                    related_model = self.model._meta.get_field(
-                        related_field
-                    ).related_model
-                    router.db_for_read(related_model)
-
-        return super().filter(*args, **filters)
-
-
-class SubscriptionPackageServiceAttributeManager(models.Manager):
+class SubscriptionPackageServiceAttributeManager(
+    RoutedBulkManagerMixin, models.Manager
+):
     def get_queryset(self):
         if settings.DB_ROUTING == 1:
-            # Ensure that the router is invoked here for the base model
-            router.db_for_read(self.model)
             # Return a custom queryset that operates on combinedView
             return SubscriptionPackageServiceAttributeQuerySet(
                 self.model, using=self._db
@@ -1035,7 +2367,7 @@ class SubscriptionPackageServiceAttributeManager(models.Manager):
         return super().get_queryset()
 
 
-class SubscriptionPackageServiceAttribute(DWHDumpable):
+class SubscriptionPackageServiceAttribute(RoutedModelMixin, DWHDumpable):
     id = models.BigAutoField(primary_key=True)
     value = models.CharField(max_length=1024, null=True)
     subscription_package_service = models.ForeignKey(
@@ -1047,77 +2379,26 @@ class SubscriptionPackageServiceAttribute(DWHDumpable):
     keep_till = models.IntegerField(default=999)
 
     def __str__(self):
-        return '{}={}'.format(self.attribute.code, self.value)
+        return '{}={}'.format(_catalog_code(self, 'attribute', 'attribute'), self.value)
 
     if settings.DB_ROUTING == 1:
         objects = SubscriptionPackageServiceAttributeManager()
 
+    class Meta:
+        base_manager_name = 'objects'
+
     def save(self, *args, **kwargs):
+        # Read this write back from the primary for the rest of the request
+        pin_to_primary()
         if settings.DB_ROUTING == 1:
             if self.pk:
-                # If args are provided, use the fields in args; otherwise, fallback to all model fields
-                if args:
-                    fields = args[0]  # Use the provided list in args
-                else:
-                    fields = [
-                        field.name for field in self._meta.get_fields()
-                    ]  # Fallback to all fields
-
-                # Iterate through the fields
-                fields_to_update = {}
-                for field_name in fields:
-                    # Check if the field exists on the model
-                    if hasattr(self, field_name):
-                        field_value = getattr(self, field_name)
-
-                        # Get the actual field object by field name
-                        field = self._meta.get_field(field_name)
-
-                        # Skip ManyToManyFields
-                        if isinstance(field, models.ManyToManyField) or isinstance(
-                            field, models.ManyToOneRel
-                        ):
-                            continue  # Skip processing ManyToMany fields
-
-                        # Check if the field is a ForeignKey
-                        if isinstance(field, models.ForeignKey):
-                            # Get the ForeignKey ID instead of the object
-                            fk_value = getattr(self, field_name + "_id")
-                            fields_to_update[field_name + "_id"] = fk_value
-                        else:
-                            # For non-ForeignKey fields, store the value
-                            fields_to_update[field_name] = field_value
-
-                # If there are fields to update, build and execute the SQL query
-                if fields_to_update:
-                    set_clause = ", ".join(
-                        [f"{field} = %s" for field in fields_to_update.keys()]
-                    )
-                    values = list(fields_to_update.values())
-                    values.append(
-                        self.id
-                    )  # Add the id to the values list for the WHERE clause
-
-                    if self.keep_till < 1000:
-                        old_instance = SubscriptionPackageServiceAttribute.objects.filter(
-                            id=self.id
-                        ).first()
-                        if old_instance:
-                            sql_query = f"UPDATE contracts_subscriptionpackageserviceattribute SET {set_clause} WHERE id = %s"
-                    else:
-                        new_instance = SubscriptionPackageServiceAttributeNew.objects.filter(
-                            id=self.id
-                        ).first()
-                        if new_instance:
-                            sql_query = f"UPDATE contracts_subscriptionpackageserviceattribute_new SET {set_clause} WHERE id = %s"
-                    with connection.cursor() as cursor:
-                        cursor.execute(sql_query, values)
+                self._routed_update(
+                    args[0] if args else kwargs.get('update_fields'),
+                    using=kwargs.get('using'),
+                )
 
             else:
                 try:
-                    self._meta.db_table = (
-                        'contracts_subscriptionpackageserviceattribute_new'
-                    )
                     super().save(*args, **kwargs)
 
                 except Exception as e:
@@ -1218,6 +2499,10 @@ class SubscriptionPackageNew(DWHDumpable):
     suspended_at = models.DateTimeField(default=None, null=True, db_index=True)
     keep_till = models.IntegerField(default=999)
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_entitlements(self.subscription_id, using=self._state.db)
+
     def deactivate(
         self,
         deactivated_by: Optional[Memo] = None,
@@ -1238,21 +2523,16 @@ class SubscriptionPackageNew(DWHDumpable):
         """
         self.deactivated_at = _action_time(deactivated_by, deactivated_at)
         self.deactivated_by = deactivated_by.id if deactivated_by else None
-        if not keep_till:
-            self.keep_till = self.subscription.calculate_keep_till(
-                package, self.deactivated_at
-            )
+        if keep_till is None:
+            self.keep_till = calculate_keep_till(self, package, self.deactivated_at)
         else:
             self.keep_till = keep_till
         self.suspended_at = None
-        for service in self.services.all():
-            service.deactivate(
-                deactivated_by,
-                deactivated_at=self.deactivated_at,
-                package=package,
-                keep_till=self.keep_till,
-            )
-        self.save()
+        with transaction.atomic(
+            using=router.db_for_write(self.__class__, instance=self)
+        ):
+            _deactivate_package_services(self)
+            self.save()
 
     def suspend(self, deactivated_by: Optional[Memo] = None):
         """
@@ -1274,13 +2554,16 @@ class SubscriptionPackageNew(DWHDumpable):
 
     def __str__(self):
         return '{},activated_at={},deactivated_at={}'.format(
-            self.package.code, self.activated_at, self.deactivated_at
+            _catalog_code(self, 'package', 'package'),
+            self.activated_at,
+            self.deactivated_at,
         )
 
     class Meta:
         indexes = [
             models.Index(fields=['-activated_at']),
             models.Index(fields=['-deactivated_at']),
+            models.Index(ActiveUntil(), name='subpkg_new_active_until'),
         ]
         db_table = "contracts_subscriptionpackage_new"
 
@@ -1325,8 +2608,15 @@ class SubscriptionPackageServiceNew(DWHDumpable):
     keep_till = models.IntegerField(default=999)
 
     class Meta:
+        indexes = [
+            models.Index(ActiveUntil(), name='subpkgservice_new_active_until'),
+        ]
         db_table = "contracts_subscriptionpackageservice_new"
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        invalidate_entitlements(self.subscription_id, using=self._state.db)
+
     def deactivate(
         self,
         deactivated_by: Optional[Memo] = None,
@@ -1347,10 +2637,8 @@ class SubscriptionPackageServiceNew(DWHDumpable):
         """
         self.deactivated_at = _action_time(deactivated_by, deactivated_at)
         self.deactivated_by = deactivated_by.id if deactivated_by else None
-        if not keep_till:
-            self.keep_till = self.subscription.calculate_keep_till(
-                package, self.deactivated_at
-            )
+        if keep_till is None:
+            self.keep_till = calculate_keep_till(self, package, self.deactivated_at)
         else:
             self.keep_till = keep_till
         self.save()
@@ -1363,25 +2651,7 @@ class SubscriptionPackageServiceNew(DWHDumpable):
             key must be a attribute code
             value must be attribute value
         """
-        switched_at = datetime_now()
-        self.deactivate(deactivated_at=switched_at)
-
-        sps = SubscriptionPackageService.objects.create(
-            subscription=self.subscription,
-            service=self.service,
-            activated_at=switched_at,
-        )
-        # add new subscription package service to all subscription packages
-        for spkg in self.subscriptionpackage_set.all():
-            spkg.services.add(sps)
-        # create new attributes
-        for attr_code, value in attrs.items():
-            if not value:
-                continue
-            attr = pc.ServiceAttribute.objects.get(code=attr_code)
-            SubscriptionPackageServiceAttribute.objects.create(
-                subscription_package_service=sps, attribute=attr, value=value
-            )
+        _save_new_attributes(self, attrs)
 
     def suspend(self, deactivated_by: Optional[Memo] = None):
         """
@@ -1403,7 +2673,9 @@ class SubscriptionPackageServiceNew(DWHDumpable):
 
     def __str__(self):
         return 'service={},activated_at={},deactivated_at={}'.format(
-            self.service.code, self.activated_at, self.deactivated_at
+            _catalog_code(self, 'service', 'service'),
+            self.activated_at,
+            self.deactivated_at,
         )
 
 
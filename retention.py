@@ -0,0 +1,329 @@
+import logging
+import re
+import time
+from typing import NamedTuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils.module_loading import import_string
+
+from routing import routing_table
+
+logger = logging.getLogger('routing.retention')
+
+# keep_till of rows it was never calculated for
+DEFAULT_PROTECTED_KEEP_TILL = (999,)
+
+# The (table, column) of the rows referring to the rows of a routed table,
+# by the legacy name of both. They may still carry a protected keep_till.
+DEFAULT_DEPENDENT_ROWS = {
+    'contracts_subscriptionpackage': (
+        ('contracts_subscriptionpackage_services', 'subscriptionpackage_id'),
+    ),
+    'contracts_subscriptionpackageservice': (
+        (
+            'contracts_subscriptionpackageserviceattribute',
+            'subscription_package_service_id',
+        ),
+        ('contracts_subscriptionpackage_services', 'subscriptionpackageservice_id'),
+    ),
+}
+
+_RANGE_BOUND = re.compile(r"FOR VALUES FROM \((-?\d+)\) TO \((-?\d+)\)")
+_LIST_BOUND = re.compile(r"FOR VALUES IN \(([-\d, ]+)\)")
+
+
+class RetentionResult(NamedTuple):
+    """
+    What the purge of one table did, or would do in a dry run.
+
+    `partitions`
+        Names of the partitions dropped whole.
+
+    `rows`
+        Number of rows deleted in batches. A dry run also counts the
+        rows of the partitions it would drop.
+
+    `dependents`
+        Number of rows of other tables deleted because they referred to
+        purged rows.
+    """
+
+    table: str
+    partitions: tuple
+    rows: int
+    dependents: int
+    batches: int
+    duration: float
+    dry_run: bool
+
+
+def log_metrics(result):
+    """
+    Default metrics sink, logging the result of each table.
+    """
+    logger.info(
+        'Retention of %s%s: %d partitions dropped, %d rows deleted in %d batches '
+        'with %d dependent rows in %.1fs',
+        result.table,
+        ' (dry run)' if result.dry_run else '',
+        len(result.partitions),
+        result.rows,
+        result.batches,
+        result.dependents,
+        result.duration,
+    )
+
+
+class RetentionPurger:
+    """
+    Purges the rows of all eight package tables whose `keep_till` lies
+    before `expired_before`.
+
+    On PostgreSQL tables partitioned by `keep_till`, partitions holding
+    only expired values are detached and dropped whole. All other
+    expired rows are deleted in batches of `batch_size` ids selected
+    through the `keep_till` predicate, one short transaction per batch
+    with `lock_timeout` applied on PostgreSQL, pausing `pause` seconds
+    between batches to throttle the load on the primary and replicas.
+
+    Rows whose `keep_till` is in `protected` (by default the field
+    default, i.e. rows that were never deactivated) are never deleted,
+    unless they refer to a purged row: the `dependents` of a table
+    (`RETENTION_DEPENDENT_ROWS`, e.g. the attributes and links of a
+    service) are deleted by parent id, from both their tables, in the
+    same transaction as the batch or partition of their parents. Tables
+    are purged children first: attributes, services, links, then
+    packages.
+
+    Each table's `RetentionResult` is passed to `metrics`, which
+    defaults to `RETENTION_METRICS_SINK`.
+    """
+
+    def __init__(
+        self,
+        expired_before,
+        batch_size=5000,
+        pause=0.1,
+        lock_timeout=2000,
+        dry_run=False,
+        protected=DEFAULT_PROTECTED_KEEP_TILL,
+        metrics=None,
+        using=DEFAULT_DB_ALIAS,
+        dependents=None,
+    ):
+        self.expired_before = expired_before
+        self.batch_size = batch_size
+        self.pause = pause
+        self.lock_timeout = lock_timeout
+        self.dry_run = dry_run
+        self.protected = tuple(protected)
+        if metrics is None:
+            metrics = getattr(settings, 'RETENTION_METRICS_SINK', log_metrics)
+            if isinstance(metrics, str):
+                metrics = import_string(metrics)
+        self.metrics = metrics
+        self.using = using
+        if dependents is None:
+            dependents = getattr(
+                settings, 'RETENTION_DEPENDENT_ROWS', DEFAULT_DEPENDENT_ROWS
+            )
+        self.dependents = dependents
+
+    def tables(self):
+        """
+        Return the physical tables in purge order, children first.
+        """
+        return [
+            db_table
+            for table in reversed(routing_table.tables)
+            for db_table in (table.legacy, table.new)
+        ]
+
+    def dependent_tables(self, db_table):
+        """
+        Return the `(table, column)` pairs of the physical tables holding
+        rows that refer to rows of `db_table`.
+        """
+        table = routing_table.get(db_table)
+        legacy = db_table if table is None else table.legacy
+        return [
+            (child_table, column)
+            for child, column in self.dependents.get(legacy, ())
+            for child_table in (
+                routing_table.get(child)[:2] if child in routing_table else (child,)
+            )
+        ]
+
+    def run(self):
+        """
+        Purge every table and return their `RetentionResult`.
+        """
+        return [self.purge_table(db_table) for db_table in self.tables()]
+
+    def purge_table(self, db_table):
+        started = time.monotonic()
+        try:
+            partitions, partition_dependents = self._drop_partitions(db_table)
+            rows, batches, dependents = self._delete_batches(db_table)
+        except Exception as e:
+            logging.error(f"Retention of {db_table} failed: {e}")
+            raise
+        result = RetentionResult(
+            db_table,
+            tuple(partitions),
+            rows,
+            partition_dependents + dependents,
+            batches,
+            time.monotonic() - started,
+            self.dry_run,
+        )
+        self.metrics(result)
+        return result
+
+    def _set_lock_timeout(self, cursor, conn):
+        if conn.vendor == 'postgresql' and self.lock_timeout:
+            cursor.execute(
+                "SELECT set_config('lock_timeout', %s, true)",
+                [f'{self.lock_timeout}ms'],
+            )
+
+    def _delete_dependents(self, cursor, db_table, id_sql, params):
+        """
+        Delete the rows referring to the rows of `db_table` selected by
+        `id_sql`, and return their number.
+        """
+        qn = connections[self.using].ops.quote_name
+        deleted = 0
+        for child_table, column in self.dependent_tables(db_table):
+            cursor.execute(
+                f"DELETE FROM {qn(child_table)} WHERE {qn(column)} IN ({id_sql})",
+                params,
+            )
+            deleted += cursor.rowcount
+        return deleted
+
+    def _count_dependents(self, cursor, db_table, id_sql, params):
+        qn = connections[self.using].ops.quote_name
+        count = 0
+        for child_table, column in self.dependent_tables(db_table):
+            cursor.execute(
+                f"SELECT COUNT(*) FROM {qn(child_table)} "
+                f"WHERE {qn(column)} IN ({id_sql})",
+                params,
+            )
+            count += cursor.fetchone()[0]
+        return count
+
+    def _expired_partitions(self, cursor, db_table):
+        """
+        Return the partitions of `db_table` holding only expired
+        `keep_till` values, if it is partitioned by `keep_till`.
+        """
+        cursor.execute(
+            "SELECT pg_get_partkeydef(c.oid) FROM pg_class c "
+            "WHERE c.oid = to_regclass(%s)",
+            [db_table],
+        )
+        row = cursor.fetchone()
+        if row is None or row[0] not in ('RANGE (keep_till)', 'LIST (keep_till)'):
+            return []
+        cursor.execute(
+            "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)",
+            [db_table],
+        )
+        expired = []
+        for name, bound in cursor.fetchall():
+            match = _RANGE_BOUND.match(bound)
+            if match:
+                # The upper bound is exclusive
+                values = range(int(match[1]), int(match[2]))
+                if int(match[2]) > self.expired_before or any(
+                    value in values for value in self.protected
+                ):
+                    continue
+                expired.append(name)
+                continue
+            match = _LIST_BOUND.match(bound)
+            if match:
+                values = [int(value) for value in match[1].split(',')]
+                if all(
+                    value < self.expired_before and value not in self.protected
+                    for value in values
+                ):
+                    expired.append(name)
+        return expired
+
+    def _drop_partitions(self, db_table):
+        conn = connections[self.using]
+        if conn.vendor != 'postgresql':
+            return [], 0
+        qn = conn.ops.quote_name
+        dependents = 0
+        with conn.cursor() as cursor:
+            partitions = self._expired_partitions(cursor, db_table)
+            if self.dry_run:
+                # Counted with the rows by `_delete_batches`
+                return partitions, 0
+            for partition in partitions:
+                with transaction.atomic(using=self.using):
+                    self._set_lock_timeout(cursor, conn)
+                    dependents += self._delete_dependents(
+                        cursor, db_table, f"SELECT {qn('id')} FROM {qn(partition)}", []
+                    )
+                    cursor.execute(
+                        f"ALTER TABLE {qn(db_table)} DETACH PARTITION {qn(partition)}"
+                    )
+                    cursor.execute(f"DROP TABLE {qn(partition)}")
+                logger.info('Dropped partition %s of %s', partition, db_table)
+        return partitions, dependents
+
+    def _delete_batches(self, db_table):
+        conn = connections[self.using]
+        qn = conn.ops.quote_name
+        where = f"{qn('keep_till')} < %s"
+        params = [self.expired_before]
+        if self.protected:
+            placeholders = ", ".join(["%s"] * len(self.protected))
+            where += f" AND {qn('keep_till')} NOT IN ({placeholders})"
+            params.extend(self.protected)
+        select_ids = f"SELECT {qn('id')} FROM {qn(db_table)} WHERE {where}"
+        with conn.cursor() as cursor:
+            if self.dry_run:
+                cursor.execute(
+                    f"SELECT COUNT(*) FROM {qn(db_table)} WHERE {where}", params
+                )
+                count = cursor.fetchone()[0]
+                dependents = self._count_dependents(
+                    cursor, db_table, select_ids, params
+                )
+                return count, -(-count // self.batch_size), dependents
+            if conn.features.has_select_for_update:
+                select_batch = f"{select_ids} LIMIT %s FOR UPDATE"
+            else:
+                select_batch = f"{select_ids} LIMIT %s"
+            rows = batches = dependents = 0
+            while True:
+                with transaction.atomic(using=self.using):
+                    self._set_lock_timeout(cursor, conn)
+                    cursor.execute(select_batch, [*params, self.batch_size])
+                    ids = [row[0] for row in cursor.fetchall()]
+                    if ids:
+                        placeholders = ", ".join(["%s"] * len(ids))
+                        dependents += self._delete_dependents(
+                            cursor, db_table, placeholders, ids
+                        )
+                        cursor.execute(
+                            f"DELETE FROM {qn(db_table)} "
+                            f"WHERE {qn('id')} IN ({placeholders})",
+                            ids,
+                        )
+                if not ids:
+                    return rows, batches, dependents
+                rows += len(ids)
+                batches += 1
+                if len(ids) < self.batch_size:
+                    return rows, batches, dependents
+                time.sleep(self.pause)
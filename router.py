@@ -1,97 +1,142 @@
+import logging
+import threading
+import time
+
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils.module_loading import import_string
+
+from routing import (
+    is_pinned_to_primary,
+    primary_pin_scope,
+    routing_scope,
+    routing_table,
+)
+
+
+def replication_lag(alias):
+    """
+    Return the replication lag of the database `alias` in seconds.
+
+    PostgreSQL standbys report the age of the last replayed transaction;
+    other backends (e.g. two local SQLite aliases) have no replication
+    and report no lag.
+    """
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return 0.0
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT CASE WHEN pg_is_in_recovery() "
+            "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) "
+            "ELSE 0 END"
+        )
+        return float(cursor.fetchone()[0])
+
+
+class ReplicaLagMonitor:
+    """
+    Tracks the replication lag of a replica by calling `probe` at most
+    once every `interval` seconds.
+
+    The probe is called with the replica alias and returns the lag in
+    seconds. A failing probe marks the replica as unusable until the
+    next successful probe.
+    """
+
+    def __init__(self, alias, probe=replication_lag, max_lag=5.0, interval=10.0):
+        self.alias = alias
+        self.probe = probe
+        self.max_lag = max_lag
+        self.interval = interval
+        self.lag = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Probe the replica and record its current lag.
+        """
+        try:
+            self.lag = self.probe(self.alias)
+        except Exception as e:
+            logging.warning(f"Replication lag probe for {self.alias} failed: {e}")
+            self.lag = None
+        self.checked_at = time.monotonic()
+
+    def is_usable(self):
+        """
+        Return True if the last measured lag is within `max_lag`,
+        probing the replica first if the measurement is stale.
+        """
+        checked_at = self.checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.interval:
+            # Only one thread probes; the others use the last measurement.
+            if self._lock.acquire(blocking=checked_at is None):
+                try:
+                    self.refresh()
+                finally:
+                    self._lock.release()
+        lag = self.lag
+        return lag is not None and lag <= self.max_lag
 
 
 class TableRouter:
     """
-    A database router that routes read operations to table_a_replica and write operations to table_a.
+    A database router for the routed package tables.
+
+    Table names are resolved through the precompiled `routing_table`
+    (reads go to the combined views, writes to the `_new` tables) by the
+    routed querysets themselves; the router never rewrites
+    `Model._meta`, so Django's cached field and relation metadata stays
+    intact.
+
+    Reads of the routed tables are sent to the `DB_READ_REPLICA` alias
+    while its replication lag, measured by `DB_REPLICA_LAG_PROBE` every
+    `DB_REPLICA_LAG_INTERVAL` seconds, stays within
+    `DB_REPLICA_MAX_LAG` seconds. They fall back to the primary when the
+    replica lags behind, inside transactions, and after the current
+    request or task wrote to the routed tables (read-your-writes).
     """
 
+    def __init__(self):
+        self.replica = getattr(settings, 'DB_READ_REPLICA', None)
+        self.lag_monitor = None
+        if self.replica:
+            probe = getattr(settings, 'DB_REPLICA_LAG_PROBE', replication_lag)
+            if isinstance(probe, str):
+                probe = import_string(probe)
+            self.lag_monitor = ReplicaLagMonitor(
+                self.replica,
+                probe=probe,
+                max_lag=getattr(settings, 'DB_REPLICA_MAX_LAG', 5.0),
+                interval=getattr(settings, 'DB_REPLICA_LAG_INTERVAL', 10.0),
+            )
+
     def db_for_read(self, model, **hints):
         """
-        Routes read operations to table_a_replica.
+        Routes reads of the routed tables to the replica when it is safe
+        to do so.
         """
-        # Checking for the specific model where you want read redirection
-        if settings.DB_ROUTING == 1:
-            if (
-                model._meta.db_table == 'contracts_subscriptionpackage'
-                or model._meta.db_table == 'contracts_subscriptionpackage_new'
-            ):
-                model._meta.db_table = 'combinedView'
-                # Clear the internal state after modifying the table name
-                model._meta._expire_cache()
-
-            if (
-                model._meta.db_table == 'contracts_subscriptionpackage_services'
-                or model._meta.db_table == 'contracts_subscriptionpackage_services_new'
-            ):
-                model._meta.db_table = 'view_contracts_subscriptionpackage_services'
-                # Clear the internal state after modifying the table name
-                model._meta._expire_cache()
-
-            if (
-                model._meta.db_table == 'contracts_subscriptionpackageservice'
-                or model._meta.db_table == 'contracts_subscriptionpackageservice_new'
-            ):
-                model._meta.db_table = 'view_contracts_subscriptionpackageservice'
-                # Clear the internal state after modifying the table name
-                model._meta._expire_cache()
-
-            if (
-                model._meta.db_table == 'contracts_subscriptionpackageserviceattribute'
-                or model._meta.db_table
-                == 'contracts_subscriptionpackageserviceattribute_new'
-            ):
-                model._meta.db_table = (
-                    'view_contracts_subscriptionpackageserviceattribute'
-                )
-                # Clear the internal state after modifying the table name
-                model._meta._expire_cache()
+        if (
+            self.lag_monitor is None
+            or model._meta.db_table not in routing_table
+            or is_pinned_to_primary()
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
             return None
-
-        return None  # Allow default behavior for everything else
+        if not self.lag_monitor.is_usable():
+            return None
+        return self.replica
 
     def db_for_write(self, model, **hints):
         """
-        Routes write operations to table_a (default table).
+        Writes of the routed tables always go to the primary, including
+        writes of instances loaded from the replica.
         """
-        if settings.DB_ROUTING == 1:
-            # Ensuring writes go to the original table
-            if (
-                model._meta.db_table == 'combinedView'
-                or model._meta.db_table == 'contracts_subscriptionpackage'
-            ):
-                model._meta.db_table = 'contracts_subscriptionpackage_new'
-                # Clear the internal state after modifying the table name
-                model._meta._expire_cache()
-            if (
-                model._meta.db_table == 'view_contracts_subscriptionpackage_services'
-                or model._meta.db_table == 'contracts_subscriptionpackage_services'
-            ):
-                model._meta.db_table = 'contracts_subscriptionpackage_services_new'
-                # Clear the internal state after modifying the table name
-                model._meta._expire_cache()
-            if (
-                model._meta.db_table == 'view_contracts_subscriptionpackageservice'
-                or model._meta.db_table == 'contracts_subscriptionpackageservice'
-            ):
-                model._meta.db_table = 'contracts_subscriptionpackageservice_new'
-                # Clear the internal state after modifying the table name
-                model._meta._expire_cache()
-
-            if (
-                model._meta.db_table
-                == 'view_contracts_subscriptionpackageserviceattribute'
-                or model._meta.db_table
-                == 'contracts_subscriptionpackageserviceattribute'
-            ):
-                model._meta.db_table = (
-                    'contracts_subscriptionpackageserviceattribute_new'
-                )
-                # Clear the internal state after modifying the table name
-                model._meta._expire_cache()
-            return None
-
-        return None  # Allow default behavior for everything else
+        if model._meta.db_table in routing_table:
+            return DEFAULT_DB_ALIAS
+        return None
 
     def allow_relation(self, obj1, obj2, **hints):
         """
@@ -104,3 +149,19 @@ class TableRouter:
         Ensure migrations are done only on the default table.
         """
         return True
+
+
+class RoutingScopeMiddleware:
+    """
+    Runs every request in its own `routing_scope` and
+    `primary_pin_scope`, so a primary pin set by a write lasts for the
+    rest of the request but does not outlive it on a reused worker
+    thread.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with primary_pin_scope(), routing_scope():
+            return self.get_response(request)
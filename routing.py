@@ -0,0 +1,204 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from types import MappingProxyType
+from typing import NamedTuple
+
+from django.conf import settings
+
+
+class RoutedTable(NamedTuple):
+    """
+    The physical tables behind one routed package table.
+
+    `legacy`
+        The original table rows were written to before the split.
+
+    `new`
+        The table new rows are written to.
+
+    `view`
+        The view returning the union of `legacy` and `new`, used for
+        reads.
+    """
+
+    legacy: str
+    new: str
+    view: str
+
+
+DEFAULT_ROUTED_TABLES = (
+    RoutedTable(
+        'contracts_subscriptionpackage',
+        'contracts_subscriptionpackage_new',
+        'combinedView',
+    ),
+    RoutedTable(
+        'contracts_subscriptionpackage_services',
+        'contracts_subscriptionpackage_services_new',
+        'view_contracts_subscriptionpackage_services',
+    ),
+    RoutedTable(
+        'contracts_subscriptionpackageservice',
+        'contracts_subscriptionpackageservice_new',
+        'view_contracts_subscriptionpackageservice',
+    ),
+    RoutedTable(
+        'contracts_subscriptionpackageserviceattribute',
+        'contracts_subscriptionpackageserviceattribute_new',
+        'view_contracts_subscriptionpackageserviceattribute',
+    ),
+)
+
+
+READ_MODES = ('view', 'legacy', 'new')
+WRITE_MODES = ('new', 'legacy')
+
+_read_mode = ContextVar('routing_read_mode', default='view')
+_write_mode = ContextVar('routing_write_mode', default='new')
+_pinned_to_primary = ContextVar('routing_pinned_to_primary', default=False)
+
+
+class RoutingTable:
+    """
+    Read and write table maps for the routed package tables.
+
+    The maps are built once from the declared `RoutedTable` entries and
+    are read-only afterwards. There is one map per routing mode (a
+    `RoutedTable` field name); every name belonging to a routed table
+    (legacy table, new table or view) resolves to the table of that
+    mode, so resolving a model's table is a single dictionary lookup
+    and never touches `Model._meta`.
+
+    Reads use the `view` mode and writes the `new` mode unless a
+    `routing_scope` selects otherwise.
+    """
+
+    def __init__(self, tables):
+        self.tables = tuple(RoutedTable(*table) for table in tables)
+        by_name = {}
+        maps = {mode: {} for mode in RoutedTable._fields}
+        for table in self.tables:
+            for name in table:
+                by_name[name] = table
+                for mode, table_name in zip(RoutedTable._fields, table):
+                    maps[mode][name] = table_name
+        self.by_name = MappingProxyType(by_name)
+        self.maps = MappingProxyType(
+            {mode: MappingProxyType(map_) for mode, map_ in maps.items()}
+        )
+        self.read_map = self.maps['view']
+        self.write_map = self.maps['new']
+
+    def __contains__(self, db_table):
+        return db_table in self.by_name
+
+    def get(self, db_table):
+        """
+        Return the `RoutedTable` the given table or view belongs to, or
+        None if it is not routed.
+        """
+        return self.by_name.get(db_table)
+
+    def current_read_map(self):
+        """
+        Return the read map of the current routing scope.
+        """
+        return self.maps[_read_mode.get()]
+
+    def current_write_map(self):
+        """
+        Return the write map of the current routing scope.
+        """
+        return self.maps[_write_mode.get()]
+
+    def read_table(self, model):
+        """
+        Return the table or view reads for the model should use in the
+        current routing scope.
+        """
+        db_table = model._meta.db_table
+        return self.current_read_map().get(db_table, db_table)
+
+    def write_table(self, model):
+        """
+        Return the table writes for the model should go to in the
+        current routing scope.
+        """
+        db_table = model._meta.db_table
+        return self.current_write_map().get(db_table, db_table)
+
+
+@contextmanager
+def routing_scope(read=None, write=None):
+    """
+    Route reads and/or writes of the current thread or task to the given
+    modes for the duration of the block.
+
+    The modes are held in context variables, so concurrent threads and
+    asyncio tasks each see their own scope and never change the tables
+    used by another request::
+
+        with routing_scope(read='legacy'):
+            packages = list(SubscriptionPackage.objects.filter(subscription_id=1))
+
+    A primary pin set by a write inside the block (see `pin_to_primary`)
+    outlives the block; it lasts until the enclosing `primary_pin_scope`
+    ends.
+
+    :param read: One of `READ_MODES`, or None to keep the current mode.
+    :param write: One of `WRITE_MODES`, or None to keep the current mode.
+    """
+    if read is not None and read not in READ_MODES:
+        raise ValueError(f'Unknown read routing mode: {read!r}')
+    if write is not None and write not in WRITE_MODES:
+        raise ValueError(f'Unknown write routing mode: {write!r}')
+    read_token = _read_mode.set(read) if read is not None else None
+    write_token = _write_mode.set(write) if write is not None else None
+    try:
+        yield
+    finally:
+        if write_token is not None:
+            _write_mode.reset(write_token)
+        if read_token is not None:
+            _read_mode.reset(read_token)
+
+
+def current_routing_mode():
+    """
+    Return the `(read, write)` modes of the current routing scope.
+    """
+    return _read_mode.get(), _write_mode.get()
+
+
+@contextmanager
+def primary_pin_scope():
+    """
+    Start the block, e.g. a request or a background task, without a
+    primary pin and drop any pin set inside it when the block exits.
+    """
+    token = _pinned_to_primary.set(False)
+    try:
+        yield
+    finally:
+        _pinned_to_primary.reset(token)
+
+
+def pin_to_primary():
+    """
+    Send the reads of the current thread or task to the primary database
+    for the rest of its `primary_pin_scope`, so it reads its own writes.
+    """
+    _pinned_to_primary.set(True)
+
+
+def is_pinned_to_primary():
+    """
+    Return True if reads of the current thread or task are pinned to the
+    primary database.
+    """
+    return _pinned_to_primary.get()
+
+
+routing_table = RoutingTable(
+    getattr(settings, 'DB_ROUTED_TABLES', DEFAULT_ROUTED_TABLES)
+)
@@ -0,0 +1,79 @@
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+
+class PointInTimeTest(TestCase):
+    """
+    `as_of()` evaluates activity at one instant through the `ActiveUntil`
+    expression indexes; `active()` keeps leaving out every suspended
+    package.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscription = apps.get_model('contracts', 'Subscription').objects.create()
+        cls.package = apps.get_model('products', 'Package').objects.create(
+            code='as-of-package'
+        )
+        cls.model = apps.get_model('contracts', 'SubscriptionPackage')
+        cls.now = timezone.now()
+        day = timedelta(days=1)
+        cls.open = cls._create(activated_at=cls.now - day)
+        cls.ending = cls._create(
+            activated_at=cls.now - day, deactivated_at=cls.now + day
+        )
+        cls.ended = cls._create(
+            activated_at=cls.now - 2 * day, deactivated_at=cls.now - day
+        )
+        cls.suspending = cls._create(
+            activated_at=cls.now - day, suspended_at=cls.now + day
+        )
+
+    @classmethod
+    def _create(cls, **kwargs):
+        return cls.model.objects.create(
+            subscription=cls.subscription, package=cls.package, **kwargs
+        )
+
+    def _ids(self, queryset):
+        return set(queryset.values_list('pk', flat=True))
+
+    def test_active_leaves_out_future_suspensions(self):
+        self.assertEqual(
+            self._ids(self.model.objects.active()), {self.open.pk, self.ending.pk}
+        )
+        self.assertEqual(
+            self._ids(self.model.objects.active(include_suspended=True)),
+            {self.open.pk, self.ending.pk, self.suspending.pk},
+        )
+
+    def test_as_of(self):
+        self.assertEqual(
+            self._ids(self.model.objects.as_of(self.now)),
+            {self.open.pk, self.ending.pk, self.suspending.pk},
+        )
+        self.assertEqual(
+            self._ids(self.model.objects.as_of(self.now - timedelta(hours=36))),
+            {self.ended.pk},
+        )
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plans differ per backend')
+    def test_as_of_uses_the_expression_indexes(self):
+        for model_name in ('SubscriptionPackage', 'SubscriptionPackageService'):
+            model = apps.get_model('contracts', model_name)
+            plan = model.objects.as_of(self.now, include_suspended=True).explain()
+            tables = [model]
+            if getattr(settings, 'DB_ROUTING', 0) == 1:
+                # Routed reads go through the view over both tables
+                tables.append(apps.get_model('contracts', f'{model_name}New'))
+            for table in tables:
+                index_names = [
+                    index.name for index in table._meta.indexes if index.expressions
+                ]
+                self.assertIn(index_names[0], plan)
@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.test import TestCase
+
+from catalog import ProductCatalog
+
+
+class ProductCatalogMissTest(TestCase):
+    """
+    Codes missing from a fresh snapshot, e.g. created by another process,
+    are read with one query instead of raising or reloading the catalog.
+    """
+
+    def setUp(self):
+        self.model = apps.get_model('products', 'Package')
+        self.model.objects.create(code='catalog-known')
+        self.catalog = ProductCatalog(check_interval=60.0)
+        self.catalog.warm()
+        # `bulk_create()` sends no `post_save`, like a write by another process
+        self.model.objects.bulk_create([self.model(code='catalog-created')])
+        self.created = self.model.objects.get(code='catalog-created')
+
+    def test_ids(self):
+        with self.assertNumQueries(1):
+            ids = self.catalog.ids('package', ['catalog-known', 'catalog-created'])
+        self.assertEqual(list(ids), ['catalog-known', 'catalog-created'])
+        self.assertEqual(ids['catalog-created'], self.created.pk)
+
+    def test_get_by_code(self):
+        with self.assertNumQueries(1):
+            entry = self.catalog.get_by_code('package', 'catalog-created')
+        self.assertEqual(entry.id, self.created.pk)
+
+    def test_unknown_code(self):
+        with self.assertNumQueries(1), self.assertRaises(self.model.DoesNotExist):
+            self.catalog.ids('package', ['catalog-known', 'catalog-unknown'])
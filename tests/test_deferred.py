@@ -0,0 +1,43 @@
+from django.apps import apps
+from django.test import TestCase
+
+
+class RoutedDeferredLoadingTest(TestCase):
+    """
+    `only()` and `defer()` querysets of the routed models compile, share
+    SQL templates per set of loaded fields, and load deferred fields on
+    access.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        subscription = apps.get_model('contracts', 'Subscription').objects.create()
+        package = apps.get_model('products', 'Package').objects.create(
+            code='deferred-package'
+        )
+        cls.model = apps.get_model('contracts', 'SubscriptionPackage')
+        cls.subscription = subscription
+        cls.package = cls.model.objects.create(
+            subscription=subscription, package=package
+        )
+
+    def test_only(self):
+        package = self.model.objects.only('id').get(pk=self.package.pk)
+        self.assertIn('activated_at', package.get_deferred_fields())
+        with self.assertNumQueries(1):
+            self.assertEqual(package.activated_at, self.package.activated_at)
+        package = self.model.objects.only('id', 'keep_till').get(pk=self.package.pk)
+        self.assertNotIn('keep_till', package.get_deferred_fields())
+
+    def test_defer(self):
+        package = self.model.objects.defer('keep_till').get(pk=self.package.pk)
+        self.assertEqual(package.get_deferred_fields(), {'keep_till'})
+        with self.assertNumQueries(1):
+            self.assertEqual(package.keep_till, self.package.keep_till)
+        package = self.model.objects.defer('activated_by').get(pk=self.package.pk)
+        self.assertEqual(package.get_deferred_fields(), {'activated_by'})
+
+    def test_cascading_delete(self):
+        # The deletion collector fetches the related packages with `only()`.
+        self.subscription.delete()
+        self.assertFalse(self.model.objects.filter(pk=self.package.pk).exists())
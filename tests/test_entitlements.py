@@ -0,0 +1,32 @@
+from unittest import mock
+
+from django.apps import apps
+from django.test import TransactionTestCase
+
+from entitlements import entitlement_cache, load_entitlements
+
+
+class EntitlementInvalidationTest(TransactionTestCase):
+    """
+    Saving a package drops the cached entitlements after the write, so
+    an entry refilled while the cache is dropped cannot hold the state
+    from before it, also outside a transaction.
+    """
+
+    def test_invalidated_after_the_write(self):
+        subscription = apps.get_model('contracts', 'Subscription').objects.create()
+        package = apps.get_model('products', 'Package').objects.create(
+            code='entitlement-package'
+        )
+        seen = []
+        delete = entitlement_cache.backend.delete
+
+        def record_and_delete(subscription_id):
+            seen.append(load_entitlements(subscription_id).package_codes)
+            delete(subscription_id)
+
+        with mock.patch.object(entitlement_cache.backend, 'delete', record_and_delete):
+            apps.get_model('contracts', 'SubscriptionPackage').objects.create(
+                subscription=subscription, package=package
+            )
+        self.assertEqual(seen, [frozenset({'entitlement-package'})])
@@ -0,0 +1,58 @@
+from django.apps import apps
+from django.conf import settings
+from django.test import TestCase
+
+
+class PackageDeactivationQueryCountTest(TestCase):
+    """
+    `deactivate()` cascades to the services of a package with one
+    set-based UPDATE per physical service table, so its number of
+    queries does not depend on the number of services.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscription = apps.get_model('contracts', 'Subscription').objects.create()
+        cls.package = apps.get_model('products', 'Package').objects.create(
+            code='query-count-package'
+        )
+        cls.service = apps.get_model('products', 'Service').objects.create(
+            code='query-count-service'
+        )
+        cls.service_tables = ['legacy']
+        if getattr(settings, 'DB_ROUTING', 0) == 1:
+            cls.service_tables.append('new')
+
+    def _package_with_services(self, count):
+        package_model = apps.get_model('contracts', 'SubscriptionPackage')
+        service_model = apps.get_model('contracts', 'SubscriptionPackageService')
+        package = package_model.objects.create(
+            subscription=self.subscription, package=self.package
+        )
+        services = [
+            service_model.objects.create(
+                subscription=self.subscription, service=self.service
+            )
+            for _ in range(count)
+        ]
+        package.services.add(*services)
+        return package, services
+
+    def _assert_deactivated(self, services):
+        service_model = apps.get_model('contracts', 'SubscriptionPackageService')
+        self.assertFalse(
+            service_model.objects.filter(
+                pk__in=[service.pk for service in services],
+                deactivated_at__isnull=True,
+            ).exists()
+        )
+
+    def test_query_count_does_not_grow_with_services(self):
+        for services_count in (1, 25):
+            with self.subTest(services=services_count):
+                package, services = self._package_with_services(services_count)
+                # SAVEPOINT, one UPDATE per physical service table, the
+                # UPDATE of the package and RELEASE SAVEPOINT
+                with self.assertNumQueries(len(self.service_tables) + 3):
+                    package.deactivate(keep_till=1)
+                self._assert_deactivated(services)
@@ -0,0 +1,54 @@
+from django.apps import apps
+from django.test import TestCase
+
+
+class RoutedResultCacheTest(TestCase):
+    """
+    The routed querysets keep Django's result cache and ordering, so
+    re-iterating a queryset and prefetched relations such as
+    `self.services.all()` cost no further queries.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        subscription = apps.get_model('contracts', 'Subscription').objects.create()
+        package = apps.get_model('products', 'Package').objects.create(
+            code='result-cache-package'
+        )
+        service = apps.get_model('products', 'Service').objects.create(
+            code='result-cache-service'
+        )
+        cls.model = apps.get_model('contracts', 'SubscriptionPackage')
+        cls.package = cls.model.objects.create(
+            subscription=subscription, package=package
+        )
+        cls.services = [
+            apps.get_model('contracts', 'SubscriptionPackageService').objects.create(
+                subscription=subscription, service=service
+            )
+            for _ in range(3)
+        ]
+        cls.package.services.add(*cls.services)
+
+    def test_repeated_iteration_uses_result_cache(self):
+        services = self.package.services.order_by('-pk')
+        with self.assertNumQueries(1):
+            first = list(services)
+            second = list(services)
+            self.assertEqual(len(services), 3)
+        self.assertEqual(first, second)
+        self.assertEqual(
+            [service.pk for service in first],
+            sorted((service.pk for service in self.services), reverse=True),
+        )
+
+    def test_prefetched_services_are_reused(self):
+        with self.assertNumQueries(2):
+            package = self.model.objects.prefetch_related('services').get(
+                pk=self.package.pk
+            )
+        with self.assertNumQueries(0):
+            first = list(package.services.all())
+            second = list(package.services.all())
+        self.assertEqual(first, second)
+        self.assertEqual(len(first), 3)
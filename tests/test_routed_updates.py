@@ -0,0 +1,55 @@
+from unittest import skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.test import TestCase
+
+from routing import routing_scope
+
+
+@skipUnless(getattr(settings, 'DB_ROUTING', 0) == 1, 'DB_ROUTING is off')
+class RoutedUpdateRoundTripTest(TestCase):
+    """
+    A routed `save()` of an existing row costs one UPDATE when the row
+    is in the table it was written to or, for loaded rows, in the write
+    table of the scope.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscription = apps.get_model('contracts', 'Subscription').objects.create()
+        cls.package = apps.get_model('products', 'Package').objects.create(
+            code='routed-update-package'
+        )
+        cls.model = apps.get_model('contracts', 'SubscriptionPackage')
+
+    def _create(self):
+        return self.model.objects.create(
+            subscription=self.subscription, package=self.package
+        )
+
+    def test_update_after_insert(self):
+        package = self._create()
+        package.fee = 10
+        with self.assertNumQueries(1):
+            package.save()
+
+    def test_update_of_loaded_row(self):
+        pk = self._create().pk
+        package = self.model.objects.get(pk=pk)
+        package.fee = 10
+        with self.assertNumQueries(1):
+            package.save()
+        self.assertEqual(self.model.objects.get(pk=pk).fee, 10)
+
+    def test_update_of_loaded_legacy_row_is_remembered(self):
+        with routing_scope(write='legacy'):
+            pk = self._create().pk
+        package = self.model.objects.get(pk=pk)
+        package.fee = 10
+        with self.assertNumQueries(2):
+            package.save()
+        package.fee = 20
+        with self.assertNumQueries(1):
+            package.save()
+        self.assertEqual(self.model.objects.get(pk=pk).fee, 20)
@@ -0,0 +1,173 @@
+from unittest import skipUnless
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
+from django.db.backends.sqlite3.base import DatabaseWrapper as SQLiteDatabaseWrapper
+from django.test import SimpleTestCase, TestCase
+
+from routing import routing_scope, routing_table
+
+try:
+    from django.db.backends.postgresql.base import (
+        DatabaseWrapper as PostgreSQLDatabaseWrapper,
+    )
+except ImproperlyConfigured:
+    PostgreSQLDatabaseWrapper = None
+
+
+def _table_ids(db_table):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT id FROM {connection.ops.quote_name(db_table)}')
+        return {row[0] for row in cursor.fetchall()}
+
+
+@skipUnless(getattr(settings, 'DB_ROUTING', 0) == 1, 'DB_ROUTING is off')
+class RoutedInsertTest(TestCase):
+    """
+    Routed inserts go to the write table of the routing scope and read
+    back the primary keys assigned there.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscription = apps.get_model('contracts', 'Subscription').objects.create()
+        cls.package = apps.get_model('products', 'Package').objects.create(
+            code='routed-insert-package'
+        )
+        cls.model = apps.get_model('contracts', 'SubscriptionPackage')
+        cls.table = routing_table.get(cls.model._meta.db_table)
+
+    def test_create(self):
+        package = self.model.objects.create(
+            subscription=self.subscription, package=self.package
+        )
+        self.assertIsNotNone(package.pk)
+        self.assertIn(package.pk, _table_ids(self.table.new))
+        self.assertNotIn(package.pk, _table_ids(self.table.legacy))
+        self.assertEqual(self.model.objects.get(pk=package.pk), package)
+
+    def test_bulk_create(self):
+        packages = self.model.objects.bulk_create(
+            [
+                self.model(subscription=self.subscription, package=self.package)
+                for _ in range(3)
+            ]
+        )
+        ids = {package.pk for package in packages}
+        if connection.features.can_return_rows_from_bulk_insert:
+            self.assertNotIn(None, ids)
+            self.assertLessEqual(ids, _table_ids(self.table.new))
+        self.assertEqual(
+            self.model.objects.filter(subscription=self.subscription).count(), 3
+        )
+
+
+@skipUnless(getattr(settings, 'DB_ROUTING', 0) == 1, 'DB_ROUTING is off')
+class RoutedBulkWriteTest(TestCase):
+    """
+    Manager `bulk_create()` and `bulk_update()` write to the legacy and
+    the new table alike.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.subscription = apps.get_model('contracts', 'Subscription').objects.create()
+        cls.package = apps.get_model('products', 'Package').objects.create(
+            code='routed-bulk-package'
+        )
+        cls.model = apps.get_model('contracts', 'SubscriptionPackage')
+        cls.table = routing_table.get(cls.model._meta.db_table)
+
+    def _bulk_create(self, count):
+        return self.model.objects.bulk_create(
+            [
+                self.model(subscription=self.subscription, package=self.package)
+                for _ in range(count)
+            ]
+        )
+
+    def _packages_in_both_tables(self):
+        with routing_scope(write='legacy'):
+            legacy = self._bulk_create(2)
+        new = self._bulk_create(2)
+        return legacy, new
+
+    def test_bulk_create_in_both_tables(self):
+        legacy, new = self._packages_in_both_tables()
+        if connection.features.can_return_rows_from_bulk_insert:
+            self.assertLessEqual(
+                {package.pk for package in legacy}, _table_ids(self.table.legacy)
+            )
+            self.assertLessEqual(
+                {package.pk for package in new}, _table_ids(self.table.new)
+            )
+        self.assertEqual(
+            self.model.objects.filter(subscription=self.subscription).count(), 4
+        )
+
+    def test_bulk_update_in_both_tables(self):
+        self._packages_in_both_tables()
+        # Loaded rows are looked for in the scope's write table first
+        packages = list(self.model.objects.filter(subscription=self.subscription))
+        for package in packages:
+            package.fee = package.pk
+            package.product_incentives_counter = 3
+        rows = self.model.objects.bulk_update(
+            packages, ['fee', 'product_incentives_counter']
+        )
+        self.assertEqual(rows, 4)
+        for package in self.model.objects.filter(subscription=self.subscription):
+            self.assertEqual(package.fee, package.pk)
+            self.assertEqual(package.product_incentives_counter, 3)
+
+
+class BulkUpdateStatementTest(SimpleTestCase):
+    """
+    The SQL of both `bulk_update_statement()` branches: a `CASE`
+    expression per field, and a join with a typed `VALUES` list on
+    PostgreSQL.
+    """
+
+    def setUp(self):
+        self.model = apps.get_model('contracts', 'SubscriptionPackage')
+        self.meta = self.model._routed_save_meta
+        self.fields = [self.meta.fields_by_name['product_incentives_counter']]
+        self.objs = [self.model(pk=1, product_incentives_counter=5)]
+        self.objs.append(self.model(pk=2, product_incentives_counter=6))
+
+    def test_case(self):
+        sqlite = SQLiteDatabaseWrapper(
+            {**connection.settings_dict, 'ENGINE': 'django.db.backends.sqlite3'}
+        )
+        sql, params = self.meta.bulk_update_statement(
+            'contracts_subscriptionpackage_new', self.fields, self.objs, sqlite
+        )
+        self.assertEqual(
+            sql,
+            'UPDATE "contracts_subscriptionpackage_new" SET '
+            '"product_incentives_counter" = CASE "id" WHEN %s THEN %s '
+            'WHEN %s THEN %s ELSE "product_incentives_counter" END '
+            'WHERE "id" IN (%s, %s)',
+        )
+        self.assertEqual(params, [1, 5, 2, 6, 1, 2])
+
+    @skipUnless(PostgreSQLDatabaseWrapper, 'psycopg is not installed')
+    def test_values(self):
+        postgresql = PostgreSQLDatabaseWrapper(
+            {**connection.settings_dict, 'ENGINE': 'django.db.backends.postgresql'}
+        )
+        sql, params = self.meta.bulk_update_statement(
+            'contracts_subscriptionpackage', self.fields, self.objs, postgresql
+        )
+        self.assertEqual(
+            sql,
+            'UPDATE "contracts_subscriptionpackage" SET '
+            '"product_incentives_counter" = v."product_incentives_counter" '
+            'FROM (VALUES (CAST(%s AS bigint), CAST(%s AS integer)), '
+            '(CAST(%s AS bigint), CAST(%s AS integer))) '
+            'AS v ("id", "product_incentives_counter") '
+            'WHERE "contracts_subscriptionpackage"."id" = v."id"',
+        )
+        self.assertEqual(params, [1, 5, 2, 6])
@@ -0,0 +1,24 @@
+from django.apps import apps
+from django.db import DEFAULT_DB_ALIAS
+from django.test import SimpleTestCase
+
+from router import TableRouter
+
+
+class TableRouterWriteTest(SimpleTestCase):
+    """
+    Writes of the routed tables go to the primary even for instances
+    loaded from the replica.
+    """
+
+    def test_routed_instance_from_replica_is_written_to_primary(self):
+        model = apps.get_model('contracts', 'SubscriptionPackage')
+        package = model()
+        package._state.db = 'replica'
+        self.assertEqual(
+            TableRouter().db_for_write(model, instance=package), DEFAULT_DB_ALIAS
+        )
+
+    def test_other_models_are_left_to_the_default_routing(self):
+        model = apps.get_model('products', 'Package')
+        self.assertIsNone(TableRouter().db_for_write(model))
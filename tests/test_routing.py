@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.db import connection
+from django.test import SimpleTestCase
+
+from pkg import SubscriptionPackageQuerySet
+from routing import (
+    READ_MODES,
+    WRITE_MODES,
+    current_routing_mode,
+    routing_scope,
+    routing_table,
+)
+
+WORKERS = 32
+ROUNDS = 200
+
+
+def _modes(worker):
+    return READ_MODES[worker % len(READ_MODES)], WRITE_MODES[worker % len(WRITE_MODES)]
+
+
+class RoutingScopeConcurrencyTest(SimpleTestCase):
+    """
+    Stress test proving that concurrent threads and asyncio tasks, each in
+    its own `routing_scope`, never see each other's tables.
+    """
+
+    def setUp(self):
+        self.model = apps.get_model('contracts', 'SubscriptionPackage')
+        self.table = routing_table.get(self.model._meta.db_table)
+
+    def _check(self, worker, read, write):
+        """
+        Return the differences between the expected and the actual routing
+        of `worker` in its current scope.
+        """
+        errors = []
+        if current_routing_mode() != (read, write):
+            errors.append((worker, 'mode', current_routing_mode()))
+        if routing_table.read_table(self.model) != getattr(self.table, read):
+            errors.append((worker, 'read', routing_table.read_table(self.model)))
+        if routing_table.write_table(self.model) != getattr(self.table, write):
+            errors.append((worker, 'write', routing_table.write_table(self.model)))
+        sql = str(SubscriptionPackageQuerySet(self.model).filter(pk=worker).query)
+        expected = f'FROM {connection.ops.quote_name(getattr(self.table, read))}'
+        if expected not in sql:
+            errors.append((worker, 'sql', sql))
+        return errors
+
+    def test_threads(self):
+        barrier = threading.Barrier(WORKERS)
+
+        def work(worker):
+            read, write = _modes(worker)
+            errors = []
+            with routing_scope(read=read, write=write):
+                # All threads are inside their scope before any checks
+                barrier.wait()
+                for _ in range(ROUNDS):
+                    errors.extend(self._check(worker, read, write))
+                    time.sleep(0)
+                with routing_scope(read='view'):
+                    errors.extend(self._check(worker, 'view', write))
+                errors.extend(self._check(worker, read, write))
+            return errors
+
+        with ThreadPoolExecutor(WORKERS) as executor:
+            results = list(executor.map(work, range(WORKERS)))
+
+        self.assertEqual([error for errors in results for error in errors], [])
+        self.assertEqual(current_routing_mode(), ('view', 'new'))
+
+    def test_tasks(self):
+        async def work(worker, started):
+            read, write = _modes(worker)
+            errors = []
+            with routing_scope(read=read, write=write):
+                started.append(worker)
+                # Let every other task enter its scope
+                while len(started) < WORKERS:
+                    await asyncio.sleep(0)
+                for _ in range(ROUNDS):
+                    errors.extend(self._check(worker, read, write))
+                    await asyncio.sleep(0)
+            return errors
+
+        async def main():
+            started = []
+            return await asyncio.gather(
+                *(work(worker, started) for worker in range(WORKERS))
+            )
+
+        results = asyncio.run(main())
+
+        self.assertEqual([error for errors in results for error in errors], [])
+        self.assertEqual(current_routing_mode(), ('view', 'new'))
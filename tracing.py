@@ -0,0 +1,107 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from routing import routing_table
+
+logger = logging.getLogger('routing.trace')
+
+
+def log_sink(record):
+    """
+    Default trace sink, logging the record to the `routing.trace`
+    logger at the configured trace level.
+    """
+    logger.log(
+        record['level'],
+        'routed query on %s took %.6fs: %s',
+        record['model'],
+        record['duration'],
+        record['sql'],
+        extra={'routing_trace': record},
+    )
+
+
+class QueryTracer:
+    """
+    Sampled debug tracing of the routed querysets.
+
+    Tracing is off unless `DB_ROUTING_TRACE_LEVEL` is set to a logging
+    level the `routing.trace` logger is enabled for. While it is off,
+    `enabled` is False and callers skip tracing without formatting or
+    compiling anything. While it is on, a `DB_ROUTING_TRACE_SAMPLE_RATE`
+    fraction of query evaluations produce a record with the model, the
+    routed table rewrites, the final SQL and the duration, passed to
+    the `DB_ROUTING_TRACE_SINK` callable.
+    """
+
+    def __init__(self, level=None, sample_rate=1.0, sink=log_sink):
+        self.configure(level, sample_rate, sink)
+
+    def configure(self, level=None, sample_rate=1.0, sink=log_sink):
+        self.level = level
+        self.sample_rate = sample_rate
+        self.sink = sink
+        self.enabled = level is not None and logger.isEnabledFor(level)
+
+    def configure_from_settings(self):
+        sink = getattr(settings, 'DB_ROUTING_TRACE_SINK', log_sink)
+        if isinstance(sink, str):
+            sink = import_string(sink)
+        self.configure(
+            level=getattr(settings, 'DB_ROUTING_TRACE_LEVEL', None),
+            sample_rate=getattr(settings, 'DB_ROUTING_TRACE_SAMPLE_RATE', 1.0),
+            sink=sink,
+        )
+
+    def sampled(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    @contextmanager
+    def trace(self, queryset):
+        """
+        Time the evaluation of `queryset` in the block and emit its
+        trace record.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            query = queryset.query
+            read_map = routing_table.current_read_map()
+            try:
+                sql, params = query.get_compiler(queryset.db).as_sql()
+            except Exception as e:
+                sql, params = f'<not compilable: {e}>', ()
+            self.sink(
+                {
+                    'level': self.level,
+                    'model': query.model._meta.label,
+                    'rewrites': {
+                        alias: read_map[table.table_name]
+                        for alias, table in query.alias_map.items()
+                        if read_map.get(table.table_name, table.table_name)
+                        != table.table_name
+                    },
+                    'sql': sql,
+                    'params': params,
+                    'duration': duration,
+                }
+            )
+
+
+tracer = QueryTracer()
+tracer.configure_from_settings()
+
+
+@receiver(setting_changed)
+def _reconfigure_tracer(setting, **kwargs):
+    if setting.startswith('DB_ROUTING_TRACE'):
+        tracer.configure_from_settings()